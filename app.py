@@ -3,7 +3,11 @@ import os
 from dotenv import load_dotenv
 from config import Config
 from flask_cors import CORS
-from extensions import db, jwt
+from extensions import db, jwt, cache, hasher, bus, pool_monitor, replicas, request_metrics
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from hashing import HashingBusy
+from db_routing import PIN_HEADER
+from json_provider import FastJSONProvider
 
 
 # Load environment variables from .env file
@@ -11,10 +15,17 @@ load_dotenv()
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = FastJSONProvider(app)
 
 # Initialize extensions
 db.init_app(app)
 jwt.init_app(app)
+cache.init_app(app)
+hasher.init_app(app)
+bus.init_app(app)
+pool_monitor.init_app(app)
+replicas.init_app(app)
+request_metrics.init_app(app)
 
 # Import models after db is initialized
 from models import User, Book, Reservation, Borrowing, Notification
@@ -31,6 +42,7 @@ from routes.reservation_routes import reservation_bp
 from routes.borrowing_routes import borrowing_bp
 from routes.notification_routes import notification_bp
 from routes.admin_routes import admin_bp
+from routes.metrics_routes import metrics_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(book_bp)
@@ -38,6 +50,13 @@ app.register_blueprint(reservation_bp)
 app.register_blueprint(borrowing_bp)
 app.register_blueprint(notification_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(metrics_bp)
+
+
+# ==================== Register CLI Commands ====================
+from commands import register_commands
+
+register_commands(app)
 
 
 # ==================== Error Handlers ====================
@@ -46,6 +65,15 @@ app.register_blueprint(admin_bp)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
 
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(error):
+    db.session.rollback()
+    return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -90,7 +118,7 @@ def init_database():
 # ==================== Main ====================
 
 # Right after creating the app
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=[PIN_HEADER])
 
 if __name__ == '__main__':
     with app.app_context():
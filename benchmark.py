@@ -0,0 +1,433 @@
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from extensions import db
+from models import Book, Borrowing, User
+from serializers import BOOK
+from jobs import send_due_reminders
+from search import apply_search, search_tokens
+from token_blocklist import TokenBlocklist
+from typeahead import TypeaheadIndex
+from catalog_cache import mark_catalog_reloaded
+from datagen import ADJECTIVES, FIRST_NAMES, LAST_NAMES, LOAN_DAYS, NOUNS, generate_books
+
+# Drives the real endpoints and reports latency percentiles and throughput per
+# scenario, either in-process through the Flask test client or over HTTP
+# against a running server (e.g. gunicorn). Compare runs against a stored
+# baseline to catch regressions.
+
+# (name, role, path); role is None, 'member' or 'admin'. {book_id} and
+# {user_id} are filled in from the database being measured.
+SCENARIOS = [
+    ('books_list', None, '/api/books?limit=50'),
+    ('books_list_filtered', None, '/api/books?category=Fiction&limit=50'),
+    ('books_search', None, '/api/books?search=golden+river&limit=20'),
+    ('book_detail', None, '/api/books/{book_id}'),
+    ('profile', 'member', '/api/auth/profile'),
+    ('notifications', 'member', '/api/notifications'),
+    ('unread_count', 'member', '/api/notifications/unread-count'),
+    ('my_borrowings', 'member', '/api/borrowings'),
+    ('popular_books_30d', 'admin', '/api/admin/reports/popular-books?window=30d'),
+    ('overdue_books', 'admin', '/api/admin/reports/overdue-books'),
+    ('user_history', 'admin', '/api/admin/reports/user-history/{user_id}'),
+]
+CREDENTIALS = {
+    'member': ('user@library.com', 'user123'),
+    'admin': ('admin@library.com', 'admin123'),
+}
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, headers=None, body=None):
+        client = self.app.test_client()
+        response = client.open(path, method=method, headers=headers or {}, json=body)
+        response.close()
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, headers=None, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=dict(
+            headers or {}, **({'Content-Type': 'application/json'} if data else {})
+        ))
+        try:
+            with urllib.request.urlopen(request) as response:
+                payload = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            payload, status = error.read(), error.code
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, None
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _login(transport, role):
+    email, password = CREDENTIALS[role]
+    status, payload = transport.request('POST', '/api/auth/login', body={'email': email, 'password': password})
+    if status != 200:
+        raise RuntimeError(f'Could not log in as {email} ({status})')
+    return {'Authorization': f"Bearer {payload['access_token']}"}
+
+
+def run_scenario(transport, path, headers, requests, concurrency, warmup, method='GET', body=None):
+    for _ in range(warmup):
+        transport.request(method, path, headers, body)
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            status, _ = transport.request(method, path, headers, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(len(latencies) / wall, 1),
+    }
+
+
+def run_benchmark(transport, params, requests=200, concurrency=1, warmup=10, only=None, progress=None):
+    """Run every scenario (or those named in `only`); returns {name: results}"""
+    headers = {role: _login(transport, role) for role in CREDENTIALS}
+    results = {}
+    for name, role, path in SCENARIOS:
+        if only and name not in only:
+            continue
+        results[name] = run_scenario(
+            transport, path.format(**params), headers.get(role), requests, concurrency, warmup
+        )
+        if progress:
+            progress(name, results[name])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as human-readable strings.
+
+    A latency percentile may grow, and throughput may drop, by at most
+    `tolerance` (a fraction); any request error is a failure.
+    """
+    failures = []
+    for name, result in results.items():
+        if result['errors']:
+            failures.append(f"{name}: {result['errors']} failed request(s)")
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric in METRICS:
+            if metric in expected and result[metric] > expected[metric] * (1 + tolerance):
+                failures.append(f'{name}: {metric} {result[metric]} > baseline {expected[metric]}')
+        if 'throughput_rps' in expected and result['throughput_rps'] < expected['throughput_rps'] * (1 - tolerance):
+            failures.append(f"{name}: throughput_rps {result['throughput_rps']} < baseline {expected['throughput_rps']}")
+    return failures
+
+
+
+def serialization_benchmark(app, rows=10000, repeat=5):
+    """Best-of-`repeat` milliseconds to load and encode `rows` books as one
+    response: ORM entities + to_dict() + stdlib json against the column
+    projection + the app's JSON provider"""
+    def orm_entities():
+        books = Book.query.order_by(Book.id).limit(rows).all()
+        return json.dumps({'books': [book.to_dict() for book in books]})
+
+    def projection():
+        result = db.session.execute(BOOK.select().order_by(Book.id).limit(rows))
+        return app.json.dumps({'books': BOOK.to_dicts(result)})
+
+    encoder = 'orjson' if app.json.use_orjson else 'stdlib'
+    results = {'rows': min(rows, db.session.query(db.func.count(Book.id)).scalar())}
+    for name, encode in (('orm_to_dict_stdlib_ms', orm_entities), (f'projection_{encoder}_ms', projection)):
+        timings = []
+        for _ in range(repeat):
+            db.session.expunge_all()
+            started = time.perf_counter()
+            encode()
+            timings.append(time.perf_counter() - started)
+        results[name] = round(min(timings) * 1000, 1)
+    return results
+
+
+def blocklist_benchmark(entries=100000, checks=100000):
+    """Microseconds per token check against a blocklist holding `entries`
+    revoked tokens and as many per-user revocations (no database involved)"""
+    blocklist = TokenBlocklist()
+    blocklist._next_refresh = float('inf')  # measure the lookup alone
+    expires = time.time() + 86400
+    for i in range(entries):
+        blocklist.add_token(f'revoked-{i}', expires)
+        blocklist.add_cutoff(i, time.time() - 3600, expires)
+
+    now = int(time.time())
+    payloads = [{'jti': f'live-{i}', 'sub': str(i % (entries * 2)), 'iat': now} for i in range(checks)]
+    started = time.perf_counter()
+    for payload in payloads:
+        blocklist.is_revoked(payload)
+    elapsed = time.perf_counter() - started
+    return {
+        'entries': entries,
+        'checks': checks,
+        'us_per_check': round(elapsed / checks * 1e6, 3)
+    }
+
+
+def typeahead_benchmark(books=100000, queries=10000, seed=0):
+    """Build time and memory of a typeahead index holding `books` synthetic
+    books, and latency of suggestions for one- to six-letter prefixes and
+    two-word queries (no database involved)"""
+    rng = random.Random(seed)
+    rows = [
+        (
+            book_id,
+            f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} of {rng.choice(LAST_NAMES)}',
+            f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            f'979-{book_id:010d}'
+        )
+        for book_id in range(1, books + 1)
+    ]
+    tracemalloc.start()
+    started = time.perf_counter()
+    typeahead = TypeaheadIndex.from_rows(rows)
+    build_seconds = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    words = ADJECTIVES + NOUNS + FIRST_NAMES + LAST_NAMES
+    terms = []
+    for _ in range(queries):
+        word = rng.choice(words)
+        terms.append(word[:rng.randint(1, 6)] if rng.random() < 0.7 else f'{rng.choice(words)} {word[:3]}')
+    latencies = []
+    for term in terms:
+        started = time.perf_counter()
+        typeahead.suggest(term)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return dict(typeahead.stats, **{
+        'build_seconds': round(build_seconds, 1),
+        'memory_mb': round(memory / 2 ** 20, 1),
+        'queries': queries,
+        'p50_us': round(_percentile(latencies, 0.50) * 1e6, 1),
+        'p99_us': round(_percentile(latencies, 0.99) * 1e6, 1)
+    })
+
+
+def search_benchmark(books=1000000, queries=200, seed=0, progress=None):
+    """Latency of the ranked, indexed book search against the ILIKE '%term%'
+    scan it replaced, with the catalog topped up to `books` generated books"""
+    rng = random.Random(seed)
+    missing = books - db.session.query(db.func.count(Book.id)).scalar()
+    if missing > 0:
+        mark_catalog_reloaded()
+        generate_books(missing, rng, progress=progress)
+
+    def indexed(term):
+        query, rank = apply_search(db.select(Book.id), term)
+        return query.order_by(rank, Book.id).limit(20)
+
+    def substring_scan(term):
+        return db.select(Book.id).where(*(
+            db.or_(Book.title.ilike(f'%{token}%'), Book.author.ilike(f'%{token}%'))
+            for token in search_tokens(term)
+        )).order_by(Book.title, Book.id).limit(20)
+
+    words = ADJECTIVES + NOUNS + FIRST_NAMES + LAST_NAMES
+    terms = [' '.join(rng.sample(words, rng.randint(1, 2))) for _ in range(queries)]
+    results = {'books': db.session.query(db.func.count(Book.id)).scalar(), 'queries': queries}
+    for name, build in (('indexed', indexed), ('ilike', substring_scan)):
+        latencies = []
+        for term in terms:
+            started = time.perf_counter()
+            db.session.execute(build(term)).all()
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        results[f'{name}_p50_ms'] = round(_percentile(latencies, 0.50) * 1000, 2)
+        results[f'{name}_p99_ms'] = round(_percentile(latencies, 0.99) * 1000, 2)
+    return results
+
+
+def checkout_stress_benchmark(app, transport, clients=50, copies=20, attempts=20):
+    """Hammer one new book with concurrent checkouts (half of them returned
+    right away) from `clients` threads and check it was never oversold.
+
+    A monitor samples the book while the threads run; the result's
+    'oversold' is True if available copies ever went below zero or open
+    loans ever exceeded the copies.
+    """
+    book = Book(title=f'Checkout stress {int(time.time())}', author='Benchmark', category='General',
+                total_copies=copies, available_copies=copies)
+    db.session.add(book)
+    db.session.commit()
+    book_id = book.id
+    user_id = db.session.query(User.id).filter_by(email=CREDENTIALS['member'][0]).scalar()
+    db.session.remove()
+    headers = _login(transport, 'admin')
+
+    open_loans = db.select(db.func.count(Borrowing.id)).where(
+        Borrowing.book_id == book_id, Borrowing.returned_at.is_(None)
+    ).scalar_subquery()
+    snapshot = db.select(Book.available_copies, open_loans).where(Book.id == book_id)
+
+    latencies, outcomes, samples = [], [], []
+    lock = threading.Lock()
+    running = threading.Event()
+    running.set()
+
+    def monitor():
+        with app.app_context():
+            while running.is_set():
+                samples.append(db.session.execute(snapshot).one())
+                db.session.remove()
+                time.sleep(0.01)
+
+    def client():
+        for _ in range(attempts):
+            started = time.perf_counter()
+            status, payload = transport.request('POST', '/api/borrowings', headers,
+                                                {'user_id': user_id, 'book_id': book_id})
+            returned = status == 201 and random.random() < 0.5
+            if returned:
+                transport.request('POST', f"/api/borrowings/{payload['borrowing']['id']}/return", headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                outcomes.append('returned' if returned else {201: 'borrowed', 400: 'unavailable'}.get(status, 'error'))
+
+    watcher = threading.Thread(target=monitor)
+    watcher.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    running.clear()
+    watcher.join()
+
+    with app.app_context():
+        samples.append(db.session.execute(snapshot).one())
+        db.session.remove()
+    available, loans = samples[-1]
+
+    latencies.sort()
+    return {
+        'clients': clients,
+        'copies': copies,
+        'checkouts': len(latencies),
+        'kept': outcomes.count('borrowed'),
+        'returned': outcomes.count('returned'),
+        'unavailable': outcomes.count('unavailable'),
+        'errors': outcomes.count('error'),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'available_copies': available,
+        'open_loans': loans,
+        'oversold': any(a < 0 or n > copies for a, n in samples) or available + loans != copies,
+    }
+
+
+def reminder_benchmark(loans=100000, copies=10, seed=0, batch_size=10000):
+    """Time the due-date reminder job with `loans` more open loans in the
+    database, due from yesterday to six days out: once when every reminder is
+    new and again when they have all been sent"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter_by(role='member')]
+    if not user_ids:
+        raise RuntimeError('No members to lend to; run /api/init-db first')
+
+    # Each generated book lends out up to `copies` loans and shelves the rest,
+    # so shelf counts stay consistent
+    for start in range(0, loans, batch_size):
+        count = min(batch_size, loans - start)
+        books = [
+            Book(title=f'Reminder benchmark {start + n}', author='Benchmark', category='General',
+                 total_copies=copies, available_copies=copies - min(copies, count - n))
+            for n in range(0, count, copies)
+        ]
+        db.session.add_all(books)
+        db.session.flush()
+        db.session.execute(db.insert(Borrowing), [
+            {
+                'user_id': rng.choice(user_ids),
+                'book_id': books[n // copies].id,
+                'borrowed_at': now - timedelta(days=LOAN_DAYS),
+                'due_date': now + timedelta(seconds=rng.uniform(-86400, 6 * 86400)),
+            }
+            for n in range(count)
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+
+    first = send_due_reminders(now)
+    repeat = send_due_reminders(now)
+    return {
+        'loans_added': loans,
+        'open_loans': db.session.query(db.func.count(Borrowing.id)).filter(Borrowing.returned_at.is_(None)).scalar(),
+        'upcoming_due': first['upcoming_due'],
+        'reminders_created': first['notifications_created'],
+        'first_run_ms': first['duration_ms'],
+        'repeat_run_ms': repeat['duration_ms'],
+        'repeat_created': repeat['notifications_created'],
+    }
+
+
+def login_benchmark(app, transport, logins=200, concurrency=8, warmup=5):
+    """Logins per second with `concurrency` clients logging in at once, and
+    per core the password hashing can occupy (the hashing processes, or the
+    client threads when hashing runs inline). Requests turned away with 503
+    because the hashing queue is full count as errors, not logins."""
+    email, password = CREDENTIALS['member']
+    result = run_scenario(transport, '/api/auth/login', None, logins, concurrency, warmup,
+                          method='POST', body={'email': email, 'password': password})
+    processes = app.config['PASSWORD_HASH_PROCESSES']
+    cores = min(os.cpu_count() or 1, processes or concurrency)
+    per_second = result['throughput_rps'] * (result['requests'] - result['errors']) / result['requests']
+    return dict(result, **{
+        'hash_method': app.config['PASSWORD_HASH_METHOD'],
+        'hash_processes': processes,
+        'logins_per_second': round(per_second, 1),
+        'logins_per_second_per_core': round(per_second / cores, 1),
+    })
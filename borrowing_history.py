@@ -0,0 +1,37 @@
+from sqlalchemy import func
+from extensions import db
+from models import Borrowing
+from serializers import BORROWING
+from pagination import decode_cursor, encode_cursor, get_limit, keyset_filter
+
+# A user's loans, newest first, served a page at a time as projected rows
+# with the book title joined in.
+
+SORT_COLUMNS = [Borrowing.borrowed_at, Borrowing.id]
+
+
+def history_page(user_id, after=None):
+    """One page of `user_id`'s borrowings after the cursor `after`; raises InvalidCursor"""
+    query = BORROWING.select().where(Borrowing.user_id == user_id)
+    
+    if after:
+        query = query.filter(keyset_filter(SORT_COLUMNS, decode_cursor(after), descending=True))
+    
+    limit = get_limit()
+    rows = db.session.execute(query.order_by(*(column.desc() for column in SORT_COLUMNS)).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    borrowings = BORROWING.to_dicts(rows[:limit])
+    
+    return {
+        'borrowing_history': borrowings,
+        'next_cursor': encode_cursor([borrowings[-1]['borrowed_at'], borrowings[-1]['id']]) if has_more else None
+    }
+
+
+def borrowing_counts(user_id):
+    """Total and not-yet-returned borrowings of `user_id`, counted in one query"""
+    total, current = db.session.query(
+        func.count(Borrowing.id),
+        func.count(Borrowing.id).filter(Borrowing.returned_at.is_(None))
+    ).filter(Borrowing.user_id == user_id).one()
+    return {'total_borrowed': total, 'currently_borrowed': current}
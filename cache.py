@@ -0,0 +1,236 @@
+import json
+import threading
+from datetime import date, datetime
+import time
+from collections import OrderedDict
+from flask import g, has_request_context
+
+try:
+    import redis
+except ImportError:  # optional dependency, only needed for CACHE_BACKEND=redis
+    redis = None
+
+
+class MemoryBackend:
+    """Per-process LRU cache with a TTL per entry and tag-based invalidation"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._discard(key)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def has(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self.stats['sets'] += 1
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._discard(key)
+                        self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class RedisBackend:
+    """Shared cache on any client speaking the redis-py API (e.g. redis.Redis or fakeredis).
+
+    Values are stored as JSON, datetimes as ISO 8601 strings; each tag is a
+    Redis set of the keys carrying it.
+    Evictions are Redis' own and are not counted here.
+    """
+
+    def __init__(self, client, prefix='library:'):
+        self.client = client
+        self.prefix = prefix
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return json.loads(raw)
+
+    def has(self, key):
+        return bool(self.client.exists(self.prefix + key))
+
+    def set(self, key, value, ttl, tags=()):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value, default=_encode_value), ex=ttl)
+        for tag in tags:
+            pipe.sadd(self.prefix + 'tag:' + tag, self.prefix + key)
+            pipe.expire(self.prefix + 'tag:' + tag, ttl)
+        pipe.execute()
+        self.stats['sets'] += 1
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys = list(self.client.smembers(tag_key))
+            if keys:
+                self.stats['invalidations'] += self.client.delete(*keys)
+            self.client.delete(tag_key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        self.stats['invalidations'] += len(keys)
+
+
+class NullBackend:
+    def __init__(self):
+        self.stats = {'hits': 0, 'misses': 0, 'sets': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        self.stats['misses'] += 1
+        return None
+
+    def has(self, key):
+        return False
+
+    def set(self, key, value, ttl, tags=()):
+        pass
+
+    def invalidate_tags(self, tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+# Set by the replica router (db_routing) on requests it routes: cache_bypass
+# when the client must read its own writes from the primary, cache_may_lag
+# when the request reads from a replica that may not have those writes yet.
+INVALIDATED_KEY = 'recently-invalidated'
+
+
+def _request_flag(name):
+    return has_request_context() and g.get(name, False)
+
+
+class Cache:
+    """Read-through cache extension configured from CACHE_* settings"""
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.default_ttl = 60
+        self.max_ttl = None
+        self.replica_lag_seconds = 0  # how long replica reads may miss a write, set by the replica router
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, backend=None):
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 60)
+        self.max_ttl = None
+        if backend is not None:
+            self.backend = backend
+            return
+
+        kind = app.config.get('CACHE_BACKEND', 'memory')
+        if kind == 'memory':
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 10000))
+            # Other workers and the CLI jobs can't invalidate this worker's entries
+            self.max_ttl = app.config.get('CACHE_MEMORY_MAX_TTL', 5)
+        elif kind == 'redis':
+            if redis is None:
+                raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+            self.backend = RedisBackend(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+        elif kind == 'null':
+            self.backend = NullBackend()
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {kind!r}')
+
+    def get(self, key):
+        if _request_flag('cache_bypass'):
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl=None, tags=()):
+        if _request_flag('cache_bypass'):
+            return
+        if _request_flag('cache_may_lag') and self.backend.has(INVALIDATED_KEY):
+            return  # the replica may still hold what was just invalidated
+        ttl = ttl or self.default_ttl
+        if self.max_ttl:
+            ttl = min(ttl, self.max_ttl)
+        self.backend.set(key, value, ttl, tags)
+
+    def get_or_set(self, key, compute, ttl=None, tags=()):
+        """Return the cached value for `key`, computing and storing it on a miss.
+
+        A computed None is not cached. `tags` may be a callable taking the computed value.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl, tags(value) if callable(tags) else tags)
+        return value
+
+    def invalidate_tags(self, tags):
+        if tags:
+            self.backend.invalidate_tags(tags)
+            self._note_invalidation()
+
+    def clear(self):
+        self.backend.clear()
+        self._note_invalidation()
+
+    def _note_invalidation(self):
+        if self.replica_lag_seconds:
+            self.backend.set(INVALIDATED_KEY, True, self.replica_lag_seconds)
+
+    @property
+    def stats(self):
+        return dict(self.backend.stats, backend=type(self.backend).__name__)
@@ -0,0 +1,74 @@
+from blinker import Namespace
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from extensions import cache, db
+from models import Book
+
+# Cached book views are tagged with `book:<id>` for every book they show and,
+# for listings, with `catalog` because new or re-titled books can enter any
+# filter combination. Changes are collected on the session and only
+# invalidated once the transaction commits.
+#
+# Bulk reloads (imports, generated data) bypass that tracking, so they send
+# catalog_reloaded once committed instead; anything else that keeps a copy
+# of the catalog (the typeahead index) connects to it as well.
+
+CATALOG_TAG = 'catalog'
+LISTING_FIELDS = ('title', 'author', 'category', 'isbn')
+
+
+catalog_reloaded = Namespace().signal('catalog-reloaded')
+
+
+def book_tag(book_id):
+    return f'book:{book_id}'
+
+
+def mark_books_changed(book_ids=(), catalog=False):
+    """Invalidate the cached views of these books when the current transaction commits"""
+    tags = db.session.info.setdefault('cache_tags', set())
+    tags.update(book_tag(book_id) for book_id in book_ids)
+    if catalog:
+        tags.add(CATALOG_TAG)
+
+
+def mark_catalog_reloaded():
+    """Send catalog_reloaded when the current transaction commits"""
+    db.session.info['catalog_reloaded'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_book_changes(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for book in session.new:
+        if isinstance(book, Book):
+            tags.add(CATALOG_TAG)
+    for book in session.deleted:
+        if isinstance(book, Book):
+            tags.update((book_tag(book.id), CATALOG_TAG))
+    for book in session.dirty:
+        if isinstance(book, Book) and session.is_modified(book, include_collections=False):
+            tags.add(book_tag(book.id))
+            state = inspect(book)
+            if any(state.attrs[field].history.has_changes() for field in LISTING_FIELDS):
+                tags.add(CATALOG_TAG)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    tags = session.info.pop('cache_tags', None)
+    if session.info.pop('catalog_reloaded', False):
+        catalog_reloaded.send(session)
+    elif tags:
+        cache.invalidate_tags(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('cache_tags', None)
+    session.info.pop('catalog_reloaded', None)
+
+
+@catalog_reloaded.connect
+def _drop_cached_views(sender):
+    cache.clear()
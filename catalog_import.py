@@ -0,0 +1,212 @@
+import csv
+import io
+import json
+import time
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import Book, book_status
+from serializers import BOOK_STATUS
+from catalog_cache import mark_catalog_reloaded
+from facets import facet_changes, record_facet_changes
+from inventory import HOLDS_WAITING, promote_holds
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'ndjson')
+
+STRING_LIMITS = {
+    'title': 200,
+    'author': 100,
+    'category': 50,
+    'isbn': 20,
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+def iter_rows(stream, fmt):
+    """Yield (line_number, dict) pairs from a binary stream without reading it all.
+
+    A CSV row is numbered by the line it starts on, counting the header.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        if reader.fieldnames is None:
+            return
+        line = reader.line_num + 1
+        for row in reader:
+            yield line, row
+            line = reader.line_num + 1
+    else:
+        for number, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def validate_row(row):
+    if not isinstance(row, dict):
+        raise RowError('Malformed row')
+
+    values = {}
+    for field in ('title', 'author', 'category', 'isbn', 'description'):
+        value = row.get(field)
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        value = value.strip() if value else None
+        if value and field in STRING_LIMITS and len(value) > STRING_LIMITS[field]:
+            raise RowError(f'{field} is longer than {STRING_LIMITS[field]} characters')
+        values[field] = value
+
+    if not values['title'] or not values['author']:
+        raise RowError('Missing required fields')
+    values['category'] = values['category'] or 'General'
+
+    total_copies = row.get('total_copies')
+    if total_copies in (None, ''):
+        total_copies = 1
+    try:
+        total_copies = int(total_copies)
+    except (TypeError, ValueError):
+        raise RowError('total_copies must be an integer')
+    if total_copies < 0:
+        raise RowError('total_copies must not be negative')
+
+    values['total_copies'] = total_copies
+    values['available_copies'] = total_copies
+    return values
+
+
+def _upsert_statement(dialect_name):
+    insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    greatest = db.func.greatest if dialect_name == 'postgresql' else db.func.max
+    statement = insert(Book)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=[Book.isbn],
+        set_={
+            'title': excluded.title,
+            'author': excluded.author,
+            'category': excluded.category,
+            'description': db.func.coalesce(excluded.description, Book.description),
+            # A restock shifts available copies by the change in total copies; cutting
+            # copies that are out on loan leaves none on the shelf rather than a debt
+            'available_copies': greatest(Book.available_copies + excluded.total_copies - Book.total_copies, 0),
+            'total_copies': excluded.total_copies,
+        }
+    )
+
+
+def _write_batch(batch):
+    """Upsert validated rows, their ISBNs distinct, in one transaction"""
+    dialect_name = db.session.get_bind().dialect.name
+
+    with_isbn = [values for values in batch if values['isbn']]
+    without_isbn = [values for values in batch if not values['isbn']]
+
+    replaced, added, restocked = [], [], []
+    if with_isbn:
+        isbns = [values['isbn'] for values in with_isbn]
+        # Lock the books being replaced, so their facet counts can be moved exactly
+        replaced = db.session.execute(
+            db.select(Book.category, Book.author, BOOK_STATUS).where(Book.isbn.in_(isbns)).with_for_update()
+        ).all()
+        db.session.execute(_upsert_statement(dialect_name), with_isbn)
+        written = db.session.execute(
+            db.select(
+                Book.id, Book.category, Book.author, BOOK_STATUS.label('status'), Book.available_copies,
+                HOLDS_WAITING.label('waiting')
+            ).where(Book.isbn.in_(isbns))
+        ).all()
+        added = [(book.category, book.author, book.status) for book in written]
+        restocked = [book for book in written if book.waiting and book.available_copies > 0]
+    if without_isbn:
+        db.session.execute(db.insert(Book), without_isbn)
+        added += [
+            (values['category'], values['author'], book_status(values['available_copies'], 0))
+            for values in without_isbn
+        ]
+    record_facet_changes(facet_changes(replaced, added))
+
+    # Restocked copies go to patrons waiting in a book's hold queue first
+    for book in restocked:
+        promote_holds(book.id, book.available_copies)
+
+    db.session.commit()
+
+
+def import_books(rows, batch_size=BATCH_SIZE, progress=None):
+    """Validate and upsert books from (row_number, dict) pairs in batches.
+
+    `progress`, if given, is called after each batch with the running report.
+    """
+    report = {'processed': 0, 'imported': 0, 'duplicates': 0, 'failed': 0, 'errors': []}
+    started = time.perf_counter()
+
+    def fail(number, message):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': number, 'error': message})
+
+    def flush(batch):
+        # Last row wins when an ISBN repeats inside one batch
+        last_line = {values['isbn']: number for number, values in batch if values['isbn']}
+        rows = [(number, values) for number, values in batch if not values['isbn'] or last_line[values['isbn']] == number]
+        report['duplicates'] += len(batch) - len(rows)
+
+        try:
+            _write_batch([values for _, values in rows])
+            report['imported'] += len(rows)
+        except SQLAlchemyError:
+            db.session.rollback()
+            # Write the batch row by row to find the rows the database rejects
+            for number, values in rows:
+                try:
+                    _write_batch([values])
+                    report['imported'] += 1
+                except SQLAlchemyError as error:
+                    db.session.rollback()
+                    fail(number, f'Rejected by database: {_database_message(error)}')
+
+        elapsed = time.perf_counter() - started
+        report['elapsed_seconds'] = round(elapsed, 3)
+        report['rows_per_second'] = round(report['processed'] / elapsed, 1) if elapsed else None
+        if progress:
+            progress(report)
+
+    batch = []
+    try:
+        for number, row in rows:
+            report['processed'] += 1
+            try:
+                batch.append((number, validate_row(row)))
+            except RowError as error:
+                fail(number, str(error))
+                continue
+
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+
+        flush(batch)
+    finally:
+        # One reload for the whole import, also when it stopped part way; a
+        # batch an error interrupted is rolled back, not committed with it
+        if report['imported']:
+            db.session.rollback()
+            mark_catalog_reloaded()
+            db.session.commit()
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+def _database_message(error):
+    """First line of the driver's message, without SQLAlchemy's statement dump"""
+    message = str(getattr(error, 'orig', None) or error).strip()
+    return message.splitlines()[0] if message else error.__class__.__name__
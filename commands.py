@@ -0,0 +1,291 @@
+import json
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import Book, Borrowing, Reservation, User
+from search import rebuild_search_index
+from facets import rebuild_facet_counts
+from catalog_import import BATCH_SIZE, FORMATS, import_books, iter_rows
+from jobs import compact_facet_deltas, expire_reservations, send_due_reminders, sweep_overdue
+from rollups import rebuild_borrow_rollup
+import benchmark
+import datagen
+
+
+@click.command('repair-reservation-counts')
+@with_appcontext
+def repair_reservation_counts():
+    """Recompute books.active_reservations from the reservations table"""
+    active = db.select(db.func.count(Reservation.id)).where(
+        Reservation.book_id == Book.id,
+        Reservation.status == 'active'
+    ).scalar_subquery()
+    
+    result = db.session.execute(
+        db.update(Book)
+        .where(Book.active_reservations != active)
+        .values(active_reservations=active)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount:
+        rebuild_facet_counts()  # the repaired books may have changed status
+    
+    click.echo(f'{result.rowcount} book(s) repaired')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Create the book search index if missing and rebuild it from books"""
+    with db.engine.begin() as connection:
+        rebuild_search_index(connection)
+    
+    click.echo('Search index rebuilt')
+
+
+@click.command('rebuild-facet-counts')
+@with_appcontext
+def rebuild_facet_counts_command():
+    """Recount the catalog facets from books, replacing the maintained counts"""
+    rows = rebuild_facet_counts()
+    click.echo(f'{rows} facet count(s) written')
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True)
+@with_appcontext
+def import_books_command(path, fmt, batch_size):
+    """Stream books from a CSV or NDJSON file and upsert them on ISBN"""
+    fmt = fmt or ('csv' if os.path.splitext(path)[1].lower() == '.csv' else 'ndjson')
+    
+    def show_progress(report):
+        click.echo(f"{report['processed']} rows processed, {report['failed']} rejected ({report['rows_per_second']} rows/s)")
+    
+    with open(path, 'rb') as stream:
+        report = import_books(iter_rows(stream, fmt), batch_size=batch_size, progress=show_progress)
+    
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(
+        f"{report['imported']} books imported, {report['duplicates']} superseded by a later row with the same ISBN, "
+        f"{report['failed']} rejected in {report['elapsed_seconds']}s"
+    )
+
+
+@click.command('rebuild-borrow-rollup')
+@with_appcontext
+def rebuild_borrow_rollup_command():
+    """Recompute the per-book daily borrow counts from the borrowings table"""
+    rows = rebuild_borrow_rollup()
+    click.echo(f'{rows} rollup row(s) written')
+
+
+def _run_job(job, interval):
+    """Run `job` once, or every `interval` seconds until interrupted"""
+    while True:
+        metrics = job()
+        click.echo(' '.join(f'{key}={value}' for key, value in metrics.items()))
+        if not interval:
+            return
+        db.session.remove()
+        time.sleep(interval)
+
+
+@click.command('sweep-overdue')
+@click.option('--interval', type=int, default=0, help='Repeat every N seconds instead of running once')
+@with_appcontext
+def sweep_overdue_command(interval):
+    """Flag overdue borrowings and notify their borrowers"""
+    _run_job(sweep_overdue, interval)
+
+
+@click.command('send-due-reminders')
+@click.option('--interval', type=int, default=0, help='Repeat every N seconds instead of running once')
+@with_appcontext
+def send_due_reminders_command(interval):
+    """Remind borrowers of loans due within 3 days"""
+    _run_job(send_due_reminders, interval)
+
+
+@click.command('expire-reservations')
+@click.option('--interval', type=int, default=0, help='Repeat every N seconds instead of running once')
+@with_appcontext
+def expire_reservations_command(interval):
+    """Expire lapsed reservations and return their copies to the shelf"""
+    _run_job(expire_reservations, interval)
+
+
+@click.command('compact-facet-deltas')
+@click.option('--interval', type=int, default=0, help='Repeat every N seconds instead of running once')
+@with_appcontext
+def compact_facet_deltas_command(interval):
+    """Fold the catalog facet count changes into one row per value"""
+    _run_job(compact_facet_deltas, interval)
+
+
+@click.command('generate-data')
+@click.option('--books', default=1000, show_default=True)
+@click.option('--users', default=100, show_default=True)
+@click.option('--borrowings', default=10000, show_default=True)
+@click.option('--seed', type=int, help='Make the generated data reproducible')
+@click.option('--batch-size', default=datagen.BATCH_SIZE, show_default=True)
+@with_appcontext
+def generate_data_command(books, users, borrowings, seed, batch_size):
+    """Add a synthetic catalog, readers (password 'password') and loan history"""
+    def show_progress(kind, done, total):
+        click.echo(f'{kind}: {done}/{total}')
+    
+    report = datagen.generate_library(books, users, borrowings, seed=seed, batch_size=batch_size, progress=show_progress)
+    click.echo(' '.join(f'{key}={value}' for key, value in report.items()))
+
+
+@click.command('benchmark')
+@click.option('--url', help='Benchmark a running server (e.g. http://127.0.0.1:5000) instead of the test client')
+@click.option('--requests', default=200, show_default=True, help='Requests per scenario')
+@click.option('--concurrency', default=1, show_default=True)
+@click.option('--warmup', default=10, show_default=True, help='Unmeasured requests per scenario')
+@click.option('--scenario', 'scenarios', multiple=True, help='Only run these scenarios (repeatable)')
+@click.option('--baseline', type=click.Path(dir_okay=False), help='JSON file of expected results')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed regression as a fraction of the baseline')
+@click.option('--save-baseline', is_flag=True, help='Write the results to --baseline instead of comparing')
+@with_appcontext
+def benchmark_command(url, requests, concurrency, warmup, scenarios, baseline, tolerance, save_baseline):
+    """Measure p50/p95/p99 latency and throughput of the main endpoints"""
+    transport = benchmark.HTTPTransport(url) if url else benchmark.TestClientTransport(current_app._get_current_object())
+    params = {
+        # The most borrowed book and the most active reader exercise the heaviest paths
+        'book_id': db.session.query(Borrowing.book_id).group_by(Borrowing.book_id).order_by(
+            db.func.count().desc()).limit(1).scalar() or db.session.query(db.func.min(Book.id)).scalar(),
+        'user_id': db.session.query(Borrowing.user_id).group_by(Borrowing.user_id).order_by(
+            db.func.count().desc()).limit(1).scalar() or db.session.query(db.func.min(User.id)).scalar(),
+    }
+    db.session.remove()
+    
+    def show_progress(name, result):
+        click.echo(f'{name:<22} ' + ' '.join(f'{key}={value}' for key, value in result.items()))
+    
+    results = benchmark.run_benchmark(
+        transport, params, requests=requests, concurrency=concurrency,
+        warmup=warmup, only=set(scenarios), progress=show_progress
+    )
+    
+    if baseline and save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo(f'Baseline written to {baseline}')
+        return
+    
+    expected = {}
+    if baseline:
+        with open(baseline) as f:
+            expected = json.load(f)
+    failures = benchmark.compare(results, expected, tolerance)
+    if failures:
+        raise click.ClickException('Benchmark regressed:\n' + '\n'.join(failures))
+
+
+@click.command('benchmark-serialization')
+@click.option('--rows', default=10000, show_default=True)
+@click.option('--repeat', default=5, show_default=True)
+@with_appcontext
+def benchmark_serialization_command(rows, repeat):
+    """Compare ORM to_dict() + stdlib json with the column projection + JSON provider"""
+    results = benchmark.serialization_benchmark(current_app._get_current_object(), rows=rows, repeat=repeat)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+@click.command('benchmark-blocklist')
+@click.option('--entries', default=100000, show_default=True, help='Revoked tokens (and revoked users) held in memory')
+@click.option('--checks', default=100000, show_default=True)
+def benchmark_blocklist_command(entries, checks):
+    """Measure the per-request cost of the revoked-token check"""
+    results = benchmark.blocklist_benchmark(entries=entries, checks=checks)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+@click.command('benchmark-typeahead')
+@click.option('--books', default=100000, show_default=True, help='Synthetic books in the index')
+@click.option('--queries', default=10000, show_default=True)
+@with_appcontext
+def benchmark_typeahead_command(books, queries):
+    """Measure the typeahead index's memory and per-query latency"""
+    results = benchmark.typeahead_benchmark(books=books, queries=queries)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+@click.command('benchmark-search')
+@click.option('--books', default=1000000, show_default=True, help='Generate books until the catalog holds this many')
+@click.option('--queries', default=200, show_default=True)
+@with_appcontext
+def benchmark_search_command(books, queries):
+    """Compare indexed search latency with the ILIKE scan it replaced"""
+    def show_progress(kind, done, total):
+        click.echo(f'{kind}: {done}/{total}')
+    
+    results = benchmark.search_benchmark(books=books, queries=queries, progress=show_progress)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+@click.command('benchmark-checkout')
+@click.option('--url', help='Stress a running server (e.g. http://127.0.0.1:5000) instead of the test client')
+@click.option('--clients', default=50, show_default=True, help='Concurrent threads checking out the same book')
+@click.option('--copies', default=20, show_default=True)
+@click.option('--attempts', default=20, show_default=True, help='Checkouts per client')
+@with_appcontext
+def benchmark_checkout_command(url, clients, copies, attempts):
+    """Check out one book from many threads at once and verify it was never oversold"""
+    app = current_app._get_current_object()
+    transport = benchmark.HTTPTransport(url) if url else benchmark.TestClientTransport(app)
+    results = benchmark.checkout_stress_benchmark(app, transport, clients=clients, copies=copies, attempts=attempts)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+    if results['oversold']:
+        raise click.ClickException('The book was oversold')
+
+
+@click.command('benchmark-reminders')
+@click.option('--loans', default=100000, show_default=True, help='Open loans to add before running the job')
+@with_appcontext
+def benchmark_reminders_command(loans):
+    """Time send-due-reminders over many open loans, first run and repeat run"""
+    results = benchmark.reminder_benchmark(loans=loans)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+@click.command('benchmark-logins')
+@click.option('--url', help='Benchmark a running server (e.g. http://127.0.0.1:5000) instead of the test client')
+@click.option('--logins', default=200, show_default=True)
+@click.option('--concurrency', default=8, show_default=True)
+@with_appcontext
+def benchmark_logins_command(url, logins, concurrency):
+    """Measure logins per second (and per core) through the password hashing pool"""
+    app = current_app._get_current_object()
+    transport = benchmark.HTTPTransport(url) if url else benchmark.TestClientTransport(app)
+    results = benchmark.login_benchmark(app, transport, logins=logins, concurrency=concurrency)
+    click.echo(' '.join(f'{key}={value}' for key, value in results.items()))
+
+
+def register_commands(app):
+    app.cli.add_command(repair_reservation_counts)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(rebuild_facet_counts_command)
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(rebuild_borrow_rollup_command)
+    app.cli.add_command(sweep_overdue_command)
+    app.cli.add_command(send_due_reminders_command)
+    app.cli.add_command(expire_reservations_command)
+    app.cli.add_command(compact_facet_deltas_command)
+    app.cli.add_command(generate_data_command)
+    app.cli.add_command(benchmark_command)
+    app.cli.add_command(benchmark_serialization_command)
+    app.cli.add_command(benchmark_blocklist_command)
+    app.cli.add_command(benchmark_typeahead_command)
+    app.cli.add_command(benchmark_search_command)
+    app.cli.add_command(benchmark_checkout_command)
+    app.cli.add_command(benchmark_reminders_command)
+    app.cli.add_command(benchmark_logins_command)
@@ -0,0 +1,217 @@
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+from extensions import db, hasher
+from models import Book, Borrowing, User
+from catalog_cache import mark_catalog_reloaded
+from facets import facet_changes, record_facet_changes, status_counts
+from rollups import rebuild_borrow_rollup
+
+# Synthetic library for load testing. Rows are built in Python and written
+# with multi-row INSERTs in batches; ids are assigned here so borrowings can
+# reference books and users without reading them back. Popularity follows a
+# Zipf-like curve: a few books and readers account for most of the loans.
+
+BATCH_SIZE = 10000
+PASSWORD = 'password'
+HISTORY_DAYS = 365
+LOAN_DAYS = 14
+
+ADJECTIVES = ['Silent', 'Hidden', 'Broken', 'Golden', 'Last', 'Distant', 'Crimson', 'Forgotten', 'Wild', 'Quiet',
+              'Burning', 'Endless', 'Secret', 'Little', 'Northern', 'Fallen', 'Bright', 'Hollow', 'Iron', 'Winter']
+NOUNS = ['River', 'Garden', 'Empire', 'Shadow', 'Kingdom', 'Voyage', 'Storm', 'Mirror', 'House', 'Machine',
+         'Orchard', 'Harbor', 'Forest', 'Letter', 'Island', 'Promise', 'Engine', 'Mountain', 'Song', 'Winter']
+FIRST_NAMES = ['Amira', 'Ben', 'Chloe', 'Daniel', 'Elena', 'Farid', 'Grace', 'Hassan', 'Ines', 'Jonas',
+               'Karim', 'Laila', 'Mona', 'Nadia', 'Omar', 'Priya', 'Rami', 'Sara', 'Tomas', 'Yara']
+LAST_NAMES = ['Adams', 'Bakr', 'Chen', 'Diaz', 'Evans', 'Fahmy', 'Garcia', 'Hughes', 'Ibrahim', 'Jensen',
+              'Khan', 'Lopez', 'Mansour', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Salem', 'Tanaka', 'Weber']
+# (category, share of the catalog)
+CATEGORIES = [('Fiction', 30), ('Science Fiction', 12), ('Romance', 10), ('Mystery', 10), ('History', 8),
+              ('Biography', 7), ('Science', 7), ('Children', 6), ('Poetry', 4), ('Philosophy', 3), ('Travel', 3)]
+
+
+def _zipf_cum_weights(n, exponent):
+    weights = itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1))
+    return list(weights)
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(db.insert(model), rows)
+
+
+def _next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _reset_sequence(model):
+    # Explicit ids don't advance PostgreSQL sequences
+    if db.session.get_bind().dialect.name == 'postgresql':
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+        ))
+
+
+def generate_users(count, rng, batch_size=BATCH_SIZE, progress=None):
+    """Insert `count` members sharing the password 'password'; returns their ids"""
+    first_id = _next_id(User)
+    password_hash = hasher.hash(PASSWORD)  # hashed once, it's the same for everyone
+    now = datetime.utcnow()
+    for start in range(0, count, batch_size):
+        _insert(User, [
+            {
+                'id': user_id,
+                'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                'email': f'reader{user_id}@example.test',
+                'password_hash': password_hash,
+                'role': 'member',
+                'created_at': now - timedelta(days=rng.randrange(HISTORY_DAYS * 3))
+            }
+            for user_id in range(first_id + start, first_id + min(start + batch_size, count))
+        ])
+        db.session.commit()
+        if progress:
+            progress('users', min(start + batch_size, count), count)
+    _reset_sequence(User)
+    db.session.commit()
+    return range(first_id, first_id + count)
+
+
+def generate_books(count, rng, batch_size=BATCH_SIZE, progress=None):
+    """Insert `count` books with all copies on the shelf; returns their ids"""
+    first_id = _next_id(Book)
+    categories = [name for name, _ in CATEGORIES]
+    category_weights = list(itertools.accumulate(share for _, share in CATEGORIES))
+    now = datetime.utcnow()
+    for start in range(0, count, batch_size):
+        rows = []
+        for book_id in range(first_id + start, first_id + min(start + batch_size, count)):
+            copies = rng.choice((1, 1, 2, 2, 3, 4, 5, 8))
+            rows.append({
+                'id': book_id,
+                'title': f'The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {book_id}',
+                'author': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                'category': rng.choices(categories, cum_weights=category_weights)[0],
+                'isbn': f'979{book_id:010d}',
+                'total_copies': copies,
+                'available_copies': copies,
+                'active_reservations': 0,
+                'description': None,
+                'created_at': now - timedelta(days=rng.randrange(HISTORY_DAYS * 5))
+            })
+        _insert(Book, rows)
+        record_facet_changes(facet_changes(added=(
+            (row['category'], row['author'], 'available') for row in rows
+        )))
+        db.session.commit()
+        if progress:
+            progress('books', min(start + batch_size, count), count)
+    _reset_sequence(Book)
+    db.session.commit()
+    return range(first_id, first_id + count)
+
+
+def generate_borrowings(count, book_ids, user_ids, rng, batch_size=BATCH_SIZE, progress=None):
+    """Insert `count` loans spread over the last year with skewed popularity.
+
+    Loans from the last LOAN_DAYS * 2 days may still be open (some of them
+    overdue); everything older has been returned. Shelf counts are settled at
+    the end with one UPDATE.
+    """
+    now = datetime.utcnow()
+    book_weights = _zipf_cum_weights(len(book_ids), 1.1)
+    user_weights = _zipf_cum_weights(len(user_ids), 0.6)
+    # Shuffle ranks so the popular books aren't simply the lowest ids
+    book_ranks = list(book_ids)
+    user_ranks = list(user_ids)
+    rng.shuffle(book_ranks)
+    rng.shuffle(user_ranks)
+    total_book_weight, total_user_weight = book_weights[-1], user_weights[-1]
+
+    for start in range(0, count, batch_size):
+        rows = []
+        for _ in range(min(batch_size, count - start)):
+            book_id = book_ranks[bisect.bisect(book_weights, rng.random() * total_book_weight, hi=len(book_ranks) - 1)]
+            user_id = user_ranks[bisect.bisect(user_weights, rng.random() * total_user_weight, hi=len(user_ranks) - 1)]
+            borrowed_at = now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+            due_date = borrowed_at + timedelta(days=LOAN_DAYS)
+            age_days = (now - borrowed_at).days
+            still_open = age_days < LOAN_DAYS * 2 and rng.random() < 0.5
+            returned_at = None if still_open else min(borrowed_at + timedelta(days=rng.uniform(1, LOAN_DAYS + 7)), now)
+            rows.append({
+                'user_id': user_id,
+                'book_id': book_id,
+                'borrowed_at': borrowed_at,
+                'due_date': due_date,
+                'returned_at': returned_at,
+                'is_overdue': returned_at is None and due_date < now
+            })
+        _insert(Borrowing, rows)
+        db.session.commit()
+        if progress:
+            progress('borrowings', start + len(rows), count)
+
+    _settle_shelves(book_ids)
+    db.session.commit()
+
+
+def _settle_shelves(book_ids):
+    """Take open loans off the shelf, closing the ones a book doesn't have copies for"""
+    in_range = Borrowing.book_id.between(book_ids.start, book_ids.stop - 1)
+    excess = db.session.execute(
+        db.select(Borrowing.book_id, db.func.count().label('open_loans'), Book.total_copies)
+        .join(Book, Book.id == Borrowing.book_id)
+        .where(in_range, Borrowing.returned_at.is_(None))
+        .group_by(Borrowing.book_id, Book.total_copies)
+        .having(db.func.count() > Book.total_copies)
+    ).all()
+    for book_id, open_loans, total_copies in excess:
+        extra_ids = db.session.execute(
+            db.select(Borrowing.id)
+            .where(Borrowing.book_id == book_id, Borrowing.returned_at.is_(None))
+            .order_by(Borrowing.borrowed_at)
+            .limit(open_loans - total_copies)
+        ).scalars().all()
+        db.session.execute(
+            db.update(Borrowing)
+            .where(Borrowing.id.in_(extra_ids))
+            .values(returned_at=Borrowing.due_date, is_overdue=False)
+            .execution_options(synchronize_session=False)
+        )
+
+    open_loans = db.select(db.func.count(Borrowing.id)).where(
+        Borrowing.book_id == Book.id,
+        Borrowing.returned_at.is_(None)
+    ).scalar_subquery()
+    generated = Book.id.between(book_ids.start, book_ids.stop - 1)
+    before = status_counts(generated)
+    db.session.execute(
+        db.update(Book)
+        .where(generated)
+        .values(available_copies=Book.total_copies - open_loans)
+        .execution_options(synchronize_session=False)
+    )
+    after = status_counts(generated)
+    record_facet_changes({('status', status): after[status] - before[status] for status in before | after})
+
+
+def generate_library(books, users, borrowings, seed=None, batch_size=BATCH_SIZE, progress=None):
+    """Add a synthetic catalog, readers and loan history; returns row counts and timing"""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    user_ids = generate_users(users, rng, batch_size, progress)
+    book_ids = generate_books(books, rng, batch_size, progress)
+    if borrowings and book_ids and user_ids:
+        generate_borrowings(borrowings, book_ids, user_ids, rng, batch_size, progress)
+        rebuild_borrow_rollup()
+    mark_catalog_reloaded()
+    db.session.commit()
+    return {
+        'books': books,
+        'users': users,
+        'borrowings': borrowings if book_ids and user_ids else 0,
+        'elapsed_seconds': round(time.perf_counter() - started, 1)
+    }
@@ -0,0 +1,113 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# Connection pool settings and instrumentation. Each gunicorn worker owns its
+# own pool, so the counters below are per worker as well.
+
+_checkout = threading.local()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that notes when each checkout starts; the checkout event, which
+    fires once a connection is handed over, turns that into the wait"""
+
+    def connect(self):
+        _checkout.started = time.perf_counter()
+        return super().connect()
+
+
+def engine_options(url, pool_size, max_overflow, timeout, recycle, pre_ping):
+    """Build SQLALCHEMY_ENGINE_OPTIONS for `url`"""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # Flask-SQLAlchemy puts in-memory SQLite on a StaticPool
+
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': timeout,
+        'pool_recycle': recycle,
+        'pool_pre_ping': pre_ping,
+    }
+
+
+class PoolMetrics:
+    """Checkout wait, in-use and overflow counters of one engine, fed by pool events"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.in_use = 0
+        self.in_use_peak = 0
+        self.overflow_connections = 0
+        # Registered on the engine so they survive the pool being recreated
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'connect', self._on_connect)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # From asking the pool to holding a connection, opening or pinging it included
+        started = getattr(_checkout, 'started', None)
+        _checkout.started = None
+        wait = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        pool = self.engine.pool
+        if isinstance(pool, QueuePool) and pool.overflow() > 0:
+            with self._lock:
+                self.overflow_connections += 1
+
+    @property
+    def stats(self):
+        pool = self.engine.pool
+        with self._lock:
+            stats = {
+                'pool': type(pool).__name__,
+                'checkouts': self.checkouts,
+                'checkout_wait_seconds_total': round(self.wait_seconds_total, 6),
+                'checkout_wait_seconds_max': round(self.wait_seconds_max, 6),
+                'in_use': self.in_use,
+                'in_use_peak': self.in_use_peak,
+                'overflow_connections': self.overflow_connections,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), idle=pool.checkedin(), overflow=max(pool.overflow(), 0))
+        return stats
+
+
+class PoolMonitor:
+    """Extension attaching PoolMetrics to every engine of the app"""
+
+    def __init__(self, engines_getter, app=None):
+        self.engines_getter = engines_getter
+        self.metrics = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with app.app_context():
+            self.metrics = {
+                bind or 'default': PoolMetrics(engine)
+                for bind, engine in self.engines_getter().items()
+            }
+
+    @property
+    def stats(self):
+        return {bind: metrics.stats for bind, metrics in self.metrics.items()}
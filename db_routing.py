@@ -0,0 +1,88 @@
+from flask import current_app, g, request
+from flask_sqlalchemy.session import Session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# Optional read replica (DATABASE_REPLICA_URL, configured as the 'replica' bind).
+# GET requests read from it unless the client wrote within the last
+# REPLICA_STICKY_SECONDS, so users always see their own changes. A view can
+# force either database with @use_primary / @use_replica from decorators.py.
+# Anything that writes, and anything that isn't a plain SELECT, goes to the
+# primary, and once a request has written it stays there.
+#
+# The client carries the "read from the primary" pin itself: a response to a
+# write sets a signed, short-lived token as the db_primary cookie and the
+# X-DB-Primary header, and a request presenting it in either is pinned. So
+# pins hold across workers and outlive nothing but their own expiry.
+#
+# The catalog cache must not undo this: a pinned request bypasses it, and
+# reads from the replica aren't stored for REPLICA_STICKY_SECONDS after an
+# invalidation, while the replica may still serve the old rows.
+
+REPLICA_BIND = 'replica'
+PIN_COOKIE = 'db_primary'
+PIN_HEADER = 'X-DB-Primary'
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or (clause is not None and clause.is_dml):
+                self.info['use_replica'] = False
+                self.info['wrote'] = True
+            elif self.info.get('use_replica') and clause is not None and clause.is_select:
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """Extension choosing the database for each request"""
+
+    def __init__(self, session_getter, cache, app=None):
+        self.session_getter = session_getter
+        self.cache = cache
+        self.enabled = False
+        self.sticky_seconds = 5
+        self._pins = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {})
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', self.sticky_seconds)
+        self._pins = URLSafeTimedSerializer(app.config['JWT_SECRET_KEY'], salt='db-primary-pin')
+        if self.enabled:
+            self.cache.replica_lag_seconds = self.sticky_seconds
+        app.before_request(self._route_request)
+        app.after_request(self._remember_write)
+
+    def _pinned(self):
+        token = request.headers.get(PIN_HEADER) or request.cookies.get(PIN_COOKIE)
+        if not token:
+            return False
+        try:
+            self._pins.loads(token, max_age=self.sticky_seconds)
+        except BadSignature:  # also raised once the pin has expired
+            return False
+        return True
+
+    def _route_request(self):
+        if not self.enabled:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        target = getattr(view, 'db_route', None)
+        if target is None:
+            target = 'replica' if request.method in ('GET', 'HEAD') else 'primary'
+        if target == 'replica' and self._pinned():
+            target = 'primary'
+            g.cache_bypass = True
+        g.cache_may_lag = target == 'replica'
+        self.session_getter().info['use_replica'] = target == 'replica'
+
+    def _remember_write(self, response):
+        if self.enabled and self.session_getter().info.get('wrote'):
+            token = self._pins.dumps('primary')
+            response.headers[PIN_HEADER] = token
+            response.set_cookie(PIN_COOKIE, token, max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
@@ -12,3 +12,15 @@ def admin_required(fn):
             return jsonify({'error': 'Admin access required'}), 403
         return fn(*args, **kwargs)
     return wrapper
+
+
+def use_primary(fn):
+    """Always serve this view from the primary database"""
+    fn.db_route = 'primary'
+    return fn
+
+
+def use_replica(fn):
+    """Serve this view from the read replica, even for non-GET requests"""
+    fn.db_route = 'replica'
+    return fn
@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from flask import Response, stream_with_context
+from extensions import db
+
+# Streams report rows straight from a server-side cursor. Statements select
+# plain columns, not ORM entities, so memory use stays flat however many rows
+# the export covers.
+
+YIELD_PER = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_lines(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([_plain(value) for value in row])
+        if count % YIELD_PER == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(rows, fields):
+    for row in rows:
+        yield json.dumps({field: _plain(value) for field, value in zip(fields, row)}) + '\n'
+
+
+def stream_export(statement, fmt, filename):
+    """Stream the rows of a column-only `statement` as CSV or NDJSON"""
+    fields = [column.name for column in statement.selected_columns]
+
+    def generate():
+        rows = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+        lines = _csv_lines(rows, fields) if fmt == 'csv' else _ndjson_lines(rows, fields)
+        yield from lines
+
+    return Response(stream_with_context(generate()), mimetype=FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'
+    })
+
+
+def parse_date_range(args):
+    """Read the optional ISO `from`/`to` bounds; raises ValueError on bad input"""
+    start = datetime.fromisoformat(args['from']) if args.get('from') else None
+    end = datetime.fromisoformat(args['to']) if args.get('to') else None
+    return start, end
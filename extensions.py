@@ -1,5 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
+from cache import Cache
+from db_pool import PoolMonitor
+from db_routing import ReplicaRouter, RoutingSession
+from hashing import PasswordHasher
+from notification_bus import NotificationBus
+from request_metrics import RequestMetrics
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
+cache = Cache()
+hasher = PasswordHasher()
+bus = NotificationBus(engine_getter=lambda: db.engine)
+pool_monitor = PoolMonitor(engines_getter=lambda: db.engines)
+replicas = ReplicaRouter(session_getter=lambda: db.session, cache=cache)
+request_metrics = RequestMetrics(pool_stats=lambda: pool_monitor.stats)
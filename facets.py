@@ -0,0 +1,184 @@
+from collections import Counter
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Book, FacetDelta, book_status
+from serializers import BOOK_STATUS
+
+# Catalog facet counts. Filtered facets are counted from the matching books
+# in one statement. Whole-catalog counts are maintained as writes happen:
+# every change that moves a book into or out of a category, author or status
+# inserts (facet, value, +1/-1) rows into facet_deltas in the same
+# transaction, and a count is the sum of its rows. Writers only ever insert,
+# so concurrent checkouts never wait on a shared counter row.
+#
+# ORM writes to books are counted by a flush hook. Statements that change
+# copies directly report the rows they touched with record_copy_changes(), and
+# bulk loads record the books they add. The compact-facet-deltas job folds
+# the rows into one per value; rebuild_facet_counts() recounts from books.
+
+FACETS = ('category', 'author', 'status')
+
+
+def _facets(rows, authors_limit):
+    facets = {'categories': [], 'authors': [], 'availability': {'available': 0, 'borrowed': 0, 'reserved': 0}}
+    for facet, value, count in rows:
+        if facet == 'status':
+            facets['availability'][value] = count
+        else:
+            facets['categories' if facet == 'category' else 'authors'].append({'value': value, 'count': count})
+    facets['categories'].sort(key=lambda item: (-item['count'], item['value']))
+    facets['authors'] = sorted(facets['authors'], key=lambda item: (-item['count'], item['value']))[:authors_limit]
+    facets['total'] = sum(facets['availability'].values())
+    return facets
+
+
+def filtered_facets(query, authors_limit=10):
+    """Facets of the books selected by `query` (a SELECT of books), counted in one statement"""
+    matched = query.with_only_columns(
+        Book.category, Book.author, BOOK_STATUS.label('status')
+    ).order_by(None).cte('matched')
+    count = db.func.count().label('count')
+    top_authors = db.select(db.literal('author').label('facet'), matched.c.author, count).group_by(
+        matched.c.author
+    ).order_by(count.desc(), matched.c.author).limit(authors_limit)
+    rows = db.session.execute(db.union_all(
+        db.select(db.literal('category').label('facet'), matched.c.category, count).group_by(matched.c.category),
+        db.select(db.literal('status').label('facet'), matched.c.status, count).group_by(matched.c.status),
+        top_authors.subquery().select()
+    )).all()
+    return _facets(rows, authors_limit)
+
+
+def catalog_facets(authors_limit=10):
+    """Facets of the whole catalog, summed from the maintained delta rows"""
+    count = db.func.sum(FacetDelta.delta).label('count')
+    summed = db.select(FacetDelta.facet, FacetDelta.value, count).group_by(
+        FacetDelta.facet, FacetDelta.value
+    ).having(count > 0)
+    top_authors = summed.where(FacetDelta.facet == 'author').order_by(count.desc(), FacetDelta.value).limit(authors_limit)
+    rows = db.session.execute(db.union_all(
+        summed.where(FacetDelta.facet.in_(('category', 'status'))),
+        top_authors.subquery().select()
+    )).all()
+    return _facets(rows, authors_limit)
+
+
+def facet_changes(removed=(), added=()):
+    """Count changes for books leaving (`removed`) and entering (`added`) the
+    counts, each book given as a (category, author, status) tuple"""
+    changes = Counter()
+    for sign, books in ((-1, removed), (1, added)):
+        for book in books:
+            for facet, value in zip(FACETS, book):
+                changes[facet, value] += sign
+    return changes
+
+
+def record_facet_changes(changes):
+    """Insert a delta row for every nonzero change in `changes`, a mapping of (facet, value) to a count"""
+    rows = [
+        {'facet': facet, 'value': value, 'delta': delta}
+        for (facet, value), delta in changes.items() if delta
+    ]
+    if rows:
+        db.session.execute(db.insert(FacetDelta), rows)
+
+
+def record_copy_changes(rows, copies=0, reservations=0):
+    """Count the status changes of an UPDATE that added `copies` available copies and
+    `reservations` active reservations; `rows` are the books' counts afterwards"""
+    changes = Counter()
+    for available, reserved in rows:
+        before = book_status(available - copies, reserved - reservations)
+        after = book_status(available, reserved)
+        if before != after:
+            changes['status', before] -= 1
+            changes['status', after] += 1
+    record_facet_changes(changes)
+
+
+def status_counts(*criteria):
+    """Books matching `criteria` per status"""
+    return Counter(dict(db.session.execute(
+        db.select(BOOK_STATUS, db.func.count()).where(*criteria).group_by(BOOK_STATUS)
+    ).all()))
+
+
+def _facet_values(book, history=False):
+    state = inspect(book)
+    values = []
+    for field in ('category', 'author', 'available_copies', 'active_reservations'):
+        changed = state.attrs[field].history.deleted if history else ()
+        value = changed[0] if changed else getattr(book, field)
+        if value is None and state.pending:
+            default = Book.__table__.c[field].default  # the flush fills it in from the column default
+            value = default.arg if default is not None else 0
+        values.append(value)
+    category, author, available, reserved = values
+    return category, author, book_status(available or 0, reserved or 0)
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_book_changes(session, flush_context, instances):
+    removed, added = [], []
+    for book in session.new:
+        if isinstance(book, Book):
+            added.append(_facet_values(book))
+    for book in session.deleted:
+        if isinstance(book, Book):
+            removed.append(_facet_values(book, history=True))
+    for book in session.dirty:
+        if isinstance(book, Book) and session.is_modified(book, include_collections=False):
+            removed.append(_facet_values(book, history=True))
+            added.append(_facet_values(book))
+    session.add_all(
+        FacetDelta(facet=facet, value=value, delta=delta)
+        for (facet, value), delta in facet_changes(removed, added).items() if delta
+    )
+
+
+def _use_snapshot():
+    # PostgreSQL: read every statement of this transaction from one snapshot,
+    # so the rows summed (or books counted) and the rows deleted are the same
+    # ones. SQLite transactions are serializable already.
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+
+def rebuild_facet_counts():
+    """Replace the delta rows with fresh counts from books; returns the rows written"""
+    _use_snapshot()
+    db.session.execute(db.delete(FacetDelta))
+    count = db.func.count()
+    result = db.session.execute(db.insert(FacetDelta).from_select(
+        ['facet', 'value', 'delta'],
+        db.union_all(*(
+            db.select(db.literal(facet), column, count).group_by(column)
+            for facet, column in zip(FACETS, (Book.category, Book.author, BOOK_STATUS))
+        ))
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+def fold_facet_deltas():
+    """Replace the delta rows with one per facet value; returns (rows before, rows after)"""
+    _use_snapshot()
+    last_id = db.session.scalar(db.select(db.func.max(FacetDelta.id)))
+    if last_id is None:
+        db.session.commit()
+        return 0, 0
+
+    folded = FacetDelta.id <= last_id
+    before = db.session.scalar(db.select(db.func.count()).where(folded))
+    total = db.func.sum(FacetDelta.delta)
+    after = db.session.execute(db.insert(FacetDelta).from_select(
+        ['facet', 'value', 'delta'],
+        db.select(FacetDelta.facet, FacetDelta.value, total).where(folded).group_by(
+            FacetDelta.facet, FacetDelta.value
+        ).having(total != 0)
+    )).rowcount
+    db.session.execute(db.delete(FacetDelta).where(folded))
+    db.session.commit()
+    return before, after
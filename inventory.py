@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+from extensions import db
+from models import HOLD_DAYS, Book, Borrowing, Notification, Reservation
+from catalog_cache import mark_books_changed
+from facets import record_copy_changes
+
+# Inventory changes are single conditional UPDATE statements so concurrent
+# requests can never oversell a title, and none of them hold a row lock for
+# longer than the statement itself. Callers commit, so each change lands in
+# the same transaction as the borrowing/reservation rows that go with it.
+#
+# Holds wait in a FIFO queue per book while no copy is free. Every queue
+# change starts with an UPDATE of the book's row, which locks it, so a book's
+# queue changes one transaction at a time. Tickets are handed out in order and
+# never renumbered: a cancelled hold leaves a gap, counted in queue_cancelled
+# until the queue is served past it. A hold's position is its ticket minus
+# queue_served, less the cancelled tickets between the two, so leaving the
+# queue costs the same however many holds wait behind.
+
+# Some queued hold is still waiting for a copy
+HOLDS_WAITING = Book.queue_served + Book.queue_cancelled < Book.queue_tickets
+
+
+def _execute(statement):
+    """Run a conditional UPDATE and report whether it matched a row"""
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(statement.returning(statement.table.c.id)).first() is not None
+    return db.session.execute(statement).rowcount == 1
+
+
+def _update_copies(book_id, *criteria, copies=0, reservations=0, **values):
+    """Add `copies` available copies and `reservations` active reservations to a book
+    if it matches `criteria`, counting any status change in the catalog facets;
+    returns whether it matched"""
+    statement = db.update(Book).where(Book.id == book_id, *criteria).values(
+        available_copies=Book.available_copies + copies,
+        active_reservations=Book.active_reservations + reservations,
+        **values
+    )
+    if db.session.get_bind().dialect.update_returning:
+        rows = db.session.execute(statement.returning(Book.available_copies, Book.active_reservations)).all()
+    elif db.session.execute(statement).rowcount == 1:
+        rows = db.session.execute(
+            db.select(Book.available_copies, Book.active_reservations).where(Book.id == book_id)
+        ).all()
+    else:
+        rows = []
+    record_copy_changes(rows, copies=copies, reservations=reservations)
+    return bool(rows)
+
+
+def take_copy(book_id, reserve=False):
+    """Take one available copy; returns False when none is left"""
+    mark_books_changed([book_id])
+    return _update_copies(book_id, Book.available_copies > 0, copies=-1, reservations=1 if reserve else 0)
+
+
+def restore_copy(book_id, unreserve=False, count=1):
+    """Put `count` copies back on the shelf"""
+    mark_books_changed([book_id])
+    return _update_copies(book_id, copies=count, reservations=-1 if unreserve else 0)
+
+
+def release_reservation_count(book_id):
+    """A reserved copy left the shelf as a borrowing"""
+    mark_books_changed([book_id])
+    return _update_copies(book_id, reservations=-1)
+
+
+def close_reservation(reservation_id, status, current='active'):
+    """Move a reservation from `current` to `status`; False if it was no longer `current`"""
+    return _execute(
+        db.update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == current)
+        .values(status=status)
+    )
+
+
+def join_queue(book_id):
+    """Take the next ticket in the book's hold queue; None if a copy is free after all"""
+    mark_books_changed([book_id])
+    if not _execute(
+        db.update(Book)
+        .where(Book.id == book_id, Book.available_copies <= 0)
+        .values(queue_tickets=Book.queue_tickets + 1)
+    ):
+        return None
+    return db.session.scalar(db.select(Book.queue_tickets).where(Book.id == book_id))
+
+
+def leave_queue(reservation_id, book_id):
+    """Cancel a queued hold; False if it was no longer queued. The holds behind it
+    keep their tickets and move up by one, as its ticket is now a gap."""
+    _execute(db.update(Book).where(Book.id == book_id).values(queue_tickets=Book.queue_tickets))  # lock the queue
+    if not close_reservation(reservation_id, 'cancelled', current='queued'):
+        return False
+
+    mark_books_changed([book_id])
+    return _execute(db.update(Book).where(Book.id == book_id).values(queue_cancelled=Book.queue_cancelled + 1))
+
+
+def promote_holds(book_id, count=1):
+    """Hold up to `count` free copies for the front of the book's queue and notify
+    those patrons; returns the ids of the promoted reservations"""
+    promoted = []
+    for _ in range(count):
+        # Takes the copy (locking the queue) if a hold is waiting, or does nothing
+        if not _update_copies(book_id, Book.available_copies > 0, HOLDS_WAITING, copies=-1, reservations=1):
+            break
+        head = db.session.execute(
+            db.select(Reservation.id, Reservation.user_id, Reservation.queue_ticket, Book.title)
+            .join(Book, Reservation.book_id == Book.id)
+            .where(Reservation.book_id == book_id, Reservation.status == 'queued')
+            .order_by(Reservation.queue_ticket)
+            .limit(1)
+        ).first()
+        if head is None:
+            # The counters promised a hold that no longer exists (say its user
+            # was deleted): give the copy back and mark the queue empty
+            _update_copies(book_id, copies=1, reservations=-1, queue_served=Book.queue_tickets, queue_cancelled=0)
+            break
+        reservation_id, user_id, ticket, title = head
+        # Serve up to the head's ticket; the gaps before it no longer count
+        skipped = ticket - Book.queue_served - 1
+        _execute(
+            db.update(Book)
+            .where(Book.id == book_id)
+            .values(
+                queue_served=ticket,
+                queue_cancelled=db.case((Book.queue_cancelled > skipped, Book.queue_cancelled - skipped), else_=0)
+            )
+        )
+        db.session.execute(
+            db.update(Reservation)
+            .where(Reservation.id == reservation_id)
+            .values(status='active', expires_at=datetime.utcnow() + timedelta(days=HOLD_DAYS))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.add(Notification(
+            user_id=user_id,
+            message=f'A copy of "{title}" is now held for you. Please pick it up within {HOLD_DAYS} days.',
+            type='reservation'
+        ))
+        promoted.append(reservation_id)
+    if promoted:
+        mark_books_changed([book_id])
+    return promoted
+
+
+def close_borrowing(borrowing_id, returned_at=None):
+    """Mark a borrowing returned; False if it was already returned"""
+    return _execute(
+        db.update(Borrowing)
+        .where(Borrowing.id == borrowing_id, Borrowing.returned_at.is_(None))
+        .values(returned_at=returned_at or datetime.utcnow())
+    )
+
+
+def close_borrowings(borrowing_ids, returned_at=None):
+    """Mark many borrowings returned in one statement; returns the ids it closed"""
+    statement = (
+        db.update(Borrowing)
+        .where(Borrowing.id.in_(borrowing_ids), Borrowing.returned_at.is_(None))
+        .values(returned_at=returned_at or datetime.utcnow())
+    )
+    if db.session.get_bind().dialect.update_returning:
+        return {row.id for row in db.session.execute(statement.returning(Borrowing.id))}
+
+    open_ids = {
+        borrowing_id for (borrowing_id,) in db.session.query(Borrowing.id).filter(
+            Borrowing.id.in_(borrowing_ids), Borrowing.returned_at.is_(None)
+        )
+    }
+    db.session.execute(statement.where(Borrowing.id.in_(open_ids)))
+    return open_ids
@@ -0,0 +1,239 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from models import Book, Borrowing, Notification, Reservation
+from catalog_cache import mark_books_changed
+from notification_events import notify_users
+from inventory import HOLDS_WAITING, promote_holds
+from facets import fold_facet_deltas, record_copy_changes
+
+# Background jobs. Each one is a short set-based transaction that returns a
+# metrics dict; run them with the matching `flask` command, from cron or with
+# --interval as a long-running process.
+
+CHUNK_SIZE = 500
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _update_returning(statement, *columns):
+    """Run an UPDATE and return the requested columns of every row it changed"""
+    statement = statement.execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+        return db.session.execute(statement.returning(*columns)).all()
+
+    # Without RETURNING, lock in the row set first, update exactly those rows
+    # and read them back, so the columns hold their new values as they would
+    table = statement.table
+    ids = db.session.scalars(db.select(table.c.id).where(statement.whereclause)).all()
+    rows = []
+    for chunk in _chunks(ids):
+        db.session.execute(statement.where(table.c.id.in_(chunk)))
+        rows += db.session.execute(db.select(*columns).where(table.c.id.in_(chunk))).all()
+    return rows
+
+
+def _insert_notifications():
+    """INSERT into notifications that skips rows already sent for the same borrowing and kind"""
+    dialect_name = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    return insert(Notification).on_conflict_do_nothing(index_elements=['borrowing_id', 'kind'])
+
+
+def _days_until(column, now):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return db.cast(db.func.floor(db.extract('epoch', column - now) / 86400), db.Integer)
+    return db.cast(db.func.julianday(column) - db.func.julianday(now), db.Integer)
+
+
+def _book_titles(book_ids):
+    titles = {}
+    for chunk in _chunks(book_ids):
+        titles.update(db.session.query(Book.id, Book.title).filter(Book.id.in_(chunk)).all())
+    return titles
+
+
+def _finish(name, metrics, started):
+    metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    current_app.logger.info('%s: %s', name, metrics)
+    return metrics
+
+
+def sweep_overdue(now=None):
+    """Flag newly overdue borrowings and notify their borrowers in one transaction"""
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+
+    newly_overdue = _update_returning(
+        db.update(Borrowing)
+        .where(
+            Borrowing.returned_at.is_(None),
+            Borrowing.due_date < now,
+            db.or_(Borrowing.is_overdue.is_(False), Borrowing.is_overdue.is_(None))
+        )
+        .values(is_overdue=True),
+        Borrowing.id, Borrowing.user_id, Borrowing.book_id
+    )
+
+    titles = _book_titles({row.book_id for row in newly_overdue})
+    if newly_overdue:
+        db.session.execute(_insert_notifications(), [
+            {
+                'user_id': row.user_id,
+                'borrowing_id': row.id,
+                'kind': 'overdue',
+                'message': f'"{titles[row.book_id]}" is overdue. Please return it as soon as possible.',
+                'type': 'overdue',
+                'is_read': False,
+                'created_at': now
+            }
+            for row in newly_overdue
+        ])
+        notify_users({row.user_id for row in newly_overdue})
+
+    db.session.commit()
+
+    return _finish('sweep_overdue', {
+        'marked_overdue': len(newly_overdue),
+        'notifications_created': len(newly_overdue)
+    }, started)
+
+
+def send_due_reminders(now=None, window=timedelta(days=3)):
+    """Remind borrowers of loans due within `window`, once per borrowing.
+
+    A single INSERT ... SELECT with an anti-join creates every missing reminder.
+    """
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+
+    upcoming = db.and_(
+        Borrowing.returned_at.is_(None),
+        Borrowing.due_date <= now + window,
+        Borrowing.due_date > now
+    )
+    already_reminded = db.exists().where(
+        Notification.borrowing_id == Borrowing.id,
+        Notification.kind == 'due_reminder'
+    )
+    message = (
+        db.literal('Reminder: "') + Book.title + '" is due in '
+        + db.cast(_days_until(Borrowing.due_date, now), db.String) + ' day(s).'
+    )
+
+    reminders = db.select(
+        Borrowing.user_id,
+        Borrowing.id,
+        db.literal('due_reminder'),
+        db.literal('due_date'),
+        message,
+        db.false(),
+        db.literal(now, db.DateTime)
+    ).join(Book, Borrowing.book_id == Book.id).where(upcoming, ~already_reminded)
+
+    statement = _insert_notifications().from_select(
+        ['user_id', 'borrowing_id', 'kind', 'type', 'message', 'is_read', 'created_at'],
+        reminders
+    )
+    if db.session.get_bind().dialect.insert_returning:
+        reminded = db.session.execute(statement.returning(Notification.user_id)).scalars().all()
+        created = len(reminded)
+        notify_users(set(reminded))
+    else:
+        created = db.session.execute(statement).rowcount
+        notify_users(None if created else ())
+    upcoming_count = db.session.query(db.func.count(Borrowing.id)).filter(upcoming).scalar()
+    db.session.commit()
+
+    return _finish('send_due_reminders', {
+        'upcoming_due': upcoming_count,
+        'notifications_created': created
+    }, started)
+
+
+def expire_reservations(now=None):
+    """Expire active reservations past `expires_at` and put their copies back.
+
+    Books are restocked with one UPDATE per distinct number of expired holds,
+    so a run costs a handful of statements however many reservations lapse;
+    books with a hold queue then hand the copies to the patrons waiting.
+    """
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+
+    expired = _update_returning(
+        db.update(Reservation)
+        .where(Reservation.status == 'active', Reservation.expires_at < now)
+        .values(status='expired'),
+        Reservation.id, Reservation.user_id, Reservation.book_id
+    )
+
+    per_book = Counter(row.book_id for row in expired)
+    books_by_count = {}
+    for book_id, count in per_book.items():
+        books_by_count.setdefault(count, []).append(book_id)
+    for count, book_ids in books_by_count.items():
+        for chunk in _chunks(book_ids):
+            restocked = _update_returning(
+                db.update(Book)
+                .where(Book.id.in_(chunk))
+                .values(
+                    available_copies=Book.available_copies + count,
+                    active_reservations=Book.active_reservations - count
+                ),
+                Book.available_copies, Book.active_reservations
+            )
+            record_copy_changes(restocked, copies=count, reservations=-count)
+    mark_books_changed(per_book)
+
+    promoted = 0
+    for chunk in _chunks(per_book):
+        waiting = db.session.scalars(
+            db.select(Book.id).where(Book.id.in_(chunk), HOLDS_WAITING)
+        ).all()
+        for book_id in waiting:
+            promoted += len(promote_holds(book_id, per_book[book_id]))
+
+    titles = _book_titles(per_book)
+    if expired:
+        db.session.execute(db.insert(Notification), [
+            {
+                'user_id': row.user_id,
+                'message': f'Your reservation for "{titles[row.book_id]}" has expired.',
+                'type': 'reservation',
+                'is_read': False,
+                'created_at': now
+            }
+            for row in expired
+        ])
+        notify_users({row.user_id for row in expired})
+
+    db.session.commit()
+
+    return _finish('expire_reservations', {
+        'reservations_expired': len(expired),
+        'books_restocked': len(per_book),
+        'holds_promoted': promoted,
+        'notifications_created': len(expired) + promoted
+    }, started)
+
+
+def compact_facet_deltas():
+    """Fold the catalog facet delta rows into one row per facet value.
+
+    Every book change adds rows, so summing them gets slower until they are
+    folded; run this every minute or so on a busy catalog.
+    """
+    started = time.perf_counter()
+    before, after = fold_facet_deltas()
+    return _finish('compact_facet_deltas', {
+        'rows_folded': before,
+        'rows_left': after
+    }, started)
@@ -0,0 +1,59 @@
+import json
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider, _default as flask_default
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the stdlib encoder is used without it
+    orjson = None
+
+
+def _default(value):
+    # ISO 8601 like the models' to_dict(), instead of Flask's HTTP dates
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return flask_default(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider using orjson when available (JSON_ENCODER: 'auto', 'orjson' or 'stdlib').
+
+    Both encoders write datetimes as ISO 8601, so list endpoints can hand
+    over raw column values instead of pre-formatted strings.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        encoder = app.config.get('JSON_ENCODER', 'auto')
+        if encoder == 'orjson' and orjson is None:
+            raise RuntimeError('JSON_ENCODER=orjson requires the orjson package')
+        if encoder not in ('auto', 'orjson', 'stdlib'):
+            raise ValueError(f'Unknown JSON_ENCODER {encoder!r}')
+        self.use_orjson = orjson is not None and encoder != 'stdlib'
+
+    def _orjson_options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.dumps(obj, default=_default, option=self._orjson_options()).decode()
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if not self.use_orjson or pretty:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -1,6 +1,24 @@
 from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
-from extensions import db
+from extensions import db, hasher
+
+LOAN_DAYS = 14  # borrowing period
+HOLD_DAYS = 3  # days to pick up a reserved copy
+
+
+def estimated_wait_days(queue_position, total_copies):
+    """Days until a queued hold reaches a copy, if every loan ahead of it runs its full period"""
+    return -(-queue_position // max(total_copies, 1)) * LOAN_DAYS
+
+
+def book_status(available_copies, active_reservations):
+    """'available' with a copy on the shelf, else 'reserved' while one is held, else 'borrowed'"""
+    if available_copies > 0:
+        return 'available'
+    elif active_reservations > 0:
+        return 'reserved'
+    else:
+        return 'borrowed'
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -18,10 +36,13 @@ class User(db.Model):
     notifications = db.relationship('Notification', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password, method='pbkdf2:sha256', salt_length=16)
+        self.password_hash = hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -35,14 +56,27 @@ class User(db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        db.Index('ix_books_title_id', 'title', 'id'),  # keyset pagination order
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False, index=True)
-    author = db.Column(db.String(100), nullable=False, index=True)
-    category = db.Column(db.String(50), nullable=False, index=True)
+    # The catalog facet counts need the old value of the columns they count by
+    # whenever one changes (see facets.py), so those load it before it is replaced
+    author = db.column_property(db.Column(db.String(100), nullable=False, index=True), active_history=True)
+    category = db.column_property(db.Column(db.String(50), nullable=False, index=True), active_history=True)
     isbn = db.Column(db.String(20), unique=True)
     total_copies = db.Column(db.Integer, default=1)
-    available_copies = db.Column(db.Integer, default=1)
+    available_copies = db.column_property(db.Column(db.Integer, default=1), active_history=True)
+    active_reservations = db.column_property(
+        db.Column(db.Integer, nullable=False, default=0, server_default='0'), active_history=True
+    )
+    # Hold queue tickets: the last one handed out, the last one promoted, and how many
+    # of those in between were cancelled while queued (see inventory.py)
+    queue_tickets = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    queue_served = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    queue_cancelled = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -51,12 +85,7 @@ class Book(db.Model):
     borrowings = db.relationship('Borrowing', backref='book', lazy=True, cascade='all, delete-orphan')
     
     def get_status(self):
-        if self.available_copies > 0:
-            return 'available'
-        elif any(r.status == 'active' for r in self.reservations): # type: ignore
-            return 'reserved'
-        else:
-            return 'borrowed'
+        return book_status(self.available_copies, self.active_reservations)
     
     def to_dict(self):
         return {
@@ -68,6 +97,7 @@ class Book(db.Model):
             'total_copies': self.total_copies,
             'available_copies': self.available_copies,
             'status': self.get_status(),
+            'queue_length': self.queue_tickets - self.queue_served - self.queue_cancelled,
             'description': self.description,
             'created_at': self.created_at.isoformat()
         }
@@ -75,20 +105,47 @@ class Book(db.Model):
 
 class Reservation(db.Model):
     __tablename__ = 'reservations'
+    __table_args__ = (
+        # Only active holds can expire; keeps the expiry scan off the history rows
+        db.Index(
+            'ix_reservations_active_expires', 'expires_at',
+            postgresql_where=db.text("status = 'active'"),
+            sqlite_where=db.text("status = 'active'")
+        ),
+        # Front of each book's hold queue, and the cancelled tickets ahead of a hold
+        db.Index('ix_reservations_queue_ticket', 'book_id', 'status', 'queue_ticket'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
-    status = db.Column(db.String(20), default='active')  # 'active', 'cancelled', 'fulfilled'
+    status = db.Column(db.String(20), default='active')  # 'queued', 'active', 'cancelled', 'fulfilled', 'expired'
     reserved_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)  # pickup deadline, set once a copy is held
+    queued_at = db.Column(db.DateTime)
+    queue_ticket = db.Column(db.Integer)  # see Book.queue_tickets
     
     def __init__(self, **kwargs):
         super(Reservation, self).__init__(**kwargs)
-        if not self.expires_at:
-            self.expires_at = datetime.utcnow() + timedelta(days=3)
+        if not self.expires_at and self.status != 'queued':
+            self.expires_at = datetime.utcnow() + timedelta(days=HOLD_DAYS)
+    
+    def queue_position(self):
+        """Place in the book's hold queue, None unless queued: the tickets after the
+        last one served up to this one, less those cancelled"""
+        if self.status != 'queued':
+            return None
+        served = self.book.queue_served # type: ignore
+        cancelled = db.session.scalar(db.select(db.func.count(Reservation.id)).where(
+            Reservation.book_id == self.book_id,
+            Reservation.status == 'cancelled',
+            Reservation.queue_ticket > served,
+            Reservation.queue_ticket < self.queue_ticket
+        ))
+        return self.queue_ticket - served - cancelled
     
     def to_dict(self):
+        queue_position = self.queue_position()
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -96,12 +153,20 @@ class Reservation(db.Model):
             'book_title': self.book.title, # type: ignore
             'status': self.status,
             'reserved_at': self.reserved_at.isoformat(),
-            'expires_at': self.expires_at.isoformat()
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'queue_position': queue_position,
+            'estimated_wait_days': (
+                estimated_wait_days(queue_position, self.book.total_copies) # type: ignore
+                if queue_position is not None else None
+            )
         }
 
 
 class Borrowing(db.Model):
     __tablename__ = 'borrowings'
+    __table_args__ = (
+        db.Index('ix_borrowings_user_borrowed', 'user_id', 'borrowed_at', 'id'),  # history pages
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -111,10 +176,13 @@ class Borrowing(db.Model):
     returned_at = db.Column(db.DateTime)
     is_overdue = db.Column(db.Boolean, default=False)
     
+    # Relationships
+    notifications = db.relationship('Notification', backref='borrowing', lazy=True, cascade='all, delete-orphan')
+    
     def __init__(self, **kwargs):
         super(Borrowing, self).__init__(**kwargs)
         if not self.due_date:
-            self.due_date = datetime.utcnow() + timedelta(days=14)
+            self.due_date = datetime.utcnow() + timedelta(days=LOAN_DAYS)
     
     def check_overdue(self):
         if not self.returned_at and datetime.utcnow() > self.due_date:
@@ -135,13 +203,33 @@ class Borrowing(db.Model):
         }
 
 
+class BookBorrowDaily(db.Model):
+    """Rollup of borrowings per book per (UTC) day, maintained incrementally"""
+    __tablename__ = 'book_borrow_daily'
+    __table_args__ = (
+        db.Index('ix_book_borrow_daily_day', 'day', 'book_id'),
+    )
+    
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    borrow_count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # At most one notification of each kind per borrowing
+        db.Index('ix_notifications_borrowing_kind', 'borrowing_id', 'kind', unique=True),
+        db.Index('ix_notifications_user_read', 'user_id', 'is_read'),
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     message = db.Column(db.Text, nullable=False)
     type = db.Column(db.String(50))  # 'due_date', 'overdue', 'reservation'
+    borrowing_id = db.Column(db.Integer, db.ForeignKey('borrowings.id'))
+    kind = db.Column(db.String(30))  # 'borrowed', 'due_reminder', 'overdue'
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -153,3 +241,29 @@ class Notification(db.Model):
             'is_read': self.is_read,
             'created_at': self.created_at.isoformat()
         }
+
+
+class TokenRevocation(db.Model):
+    """Revoked access tokens: a single token (jti), or with jti NULL every token
+    of the user issued up to revoked_at. Rows are only needed until expires_at."""
+    __tablename__ = 'token_revocations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class FacetDelta(db.Model):
+    """Changes to the catalog facet counts: a book entering (+1) or leaving (-1) a
+    category, author or status. A facet's count is the sum of its rows (see facets.py)."""
+    __tablename__ = 'facet_deltas'
+    __table_args__ = (
+        db.Index('ix_facet_deltas_facet_value', 'facet', 'value', 'delta'),  # summed without reading the table
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    facet = db.Column(db.String(20), nullable=False)  # 'category', 'author' or 'status'
+    value = db.Column(db.String(100), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,175 @@
+import logging
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Fan-out of "user X has new notifications" wake-ups to open notification
+# streams. Messages carry only user ids: each stream then reads its new rows
+# from the database by id, which also makes resuming after a reconnect and
+# coalescing bursts trivial (a connection never buffers more than one wake-up).
+
+BROADCAST = '*'
+PG_CHANNEL = 'library_notifications'
+PG_PAYLOAD_LIMIT = 7900  # pg_notify payloads must stay below 8000 bytes
+
+
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._pending = threading.Event()
+
+    def wake(self):
+        self._pending.set()
+
+    def wait(self, timeout):
+        """Block until woken or `timeout` elapses; returns True if woken"""
+        woken = self._pending.wait(timeout)
+        self._pending.clear()
+        return woken
+
+
+class MemoryBroker:
+    """Delivers wake-ups to streams in this process only"""
+
+    def __init__(self):
+        self._subscriptions = {}  # user_id -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_ids):
+        self.dispatch(user_ids)
+
+    def dispatch(self, user_ids):
+        with self._lock:
+            if user_ids is None:
+                targets = [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+            else:
+                targets = [s for user_id in user_ids for s in self._subscriptions.get(user_id, ())]
+        for subscription in targets:
+            subscription.wake()
+
+
+class PostgresBroker(MemoryBroker):
+    """Relays wake-ups between processes with PostgreSQL LISTEN/NOTIFY.
+
+    Each process runs one listener thread on a dedicated connection, started
+    with the first subscription so forked workers each get their own.
+    """
+
+    def __init__(self, engine_getter):
+        super().__init__()
+        self._engine_getter = engine_getter
+        self._listener = None
+
+    def subscribe(self, user_id):
+        if self._listener is None or not self._listener.is_alive():
+            with self._lock:
+                if self._listener is None or not self._listener.is_alive():
+                    self._listener = threading.Thread(target=self._listen, args=(self._engine_getter(),), daemon=True)
+                    self._listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids):
+        payloads = [BROADCAST] if user_ids is None else _chunk_payloads(user_ids)
+        with self._engine_getter().connect() as connection:
+            for payload in payloads:
+                connection.exec_driver_sql('SELECT pg_notify(%(channel)s, %(payload)s)', {
+                    'channel': PG_CHANNEL, 'payload': payload
+                })
+            connection.commit()
+
+    def _listen(self, engine):
+        while True:
+            try:
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.driver_connection
+                dbapi_connection.autocommit = True
+                dbapi_connection.cursor().execute(f'LISTEN {PG_CHANNEL}')
+                while True:
+                    if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        payload = dbapi_connection.notifies.pop(0).payload
+                        self.dispatch(None if payload == BROADCAST else [int(i) for i in payload.split(',')])
+            except Exception:
+                logger.exception('Notification listener failed, reconnecting')
+                time.sleep(1)
+
+
+def _chunk_payloads(user_ids):
+    payloads, current = [], ''
+    for user_id in sorted(set(user_ids)):
+        part = str(user_id)
+        if current and len(current) + len(part) + 1 > PG_PAYLOAD_LIMIT:
+            payloads.append(current)
+            current = ''
+        current = f'{current},{part}' if current else part
+    if current:
+        payloads.append(current)
+    return payloads
+
+
+class NotificationBus:
+    """Extension wrapping the configured broker (NOTIFICATION_BROKER: 'memory' or 'postgres')"""
+
+    def __init__(self, engine_getter, app=None):
+        self.engine_getter = engine_getter
+        self.broker = MemoryBroker()
+        self.max_streams = 1000
+        self._open_streams = 0
+        self._streams_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('NOTIFICATION_BROKER', 'memory')
+        if kind == 'memory':
+            self.broker = MemoryBroker()
+        elif kind == 'postgres':
+            self.broker = PostgresBroker(self.engine_getter)
+        else:
+            raise ValueError(f'Unknown NOTIFICATION_BROKER {kind!r}')
+        self.max_streams = app.config.get('SSE_MAX_STREAMS', 1000)
+
+    def open_stream(self):
+        """Claim one of this worker's SSE_MAX_STREAMS stream slots; False when none is left"""
+        with self._streams_lock:
+            if self._open_streams >= self.max_streams:
+                return False
+            self._open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._streams_lock:
+            self._open_streams -= 1
+
+    def subscribe(self, user_id):
+        return self.broker.subscribe(user_id)
+
+    def unsubscribe(self, subscription):
+        self.broker.unsubscribe(subscription)
+
+    def publish(self, user_ids):
+        """Wake the streams of `user_ids` (None wakes every stream)"""
+        try:
+            self.broker.publish(user_ids)
+        except Exception:
+            # Streams still catch up from the database on their next wake-up or reconnect
+            logger.exception('Failed to publish notification wake-ups')
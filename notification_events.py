@@ -0,0 +1,39 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import bus, db
+from models import Notification
+
+# New notifications wake their users' open streams once the transaction that
+# wrote them commits. ORM inserts are picked up automatically; bulk inserts
+# call notify_users() before committing.
+
+
+def notify_users(user_ids):
+    """Wake these users' streams when the current transaction commits (None: every stream)"""
+    if user_ids is None:
+        db.session.info['notify_everyone'] = True
+    else:
+        db.session.info.setdefault('notify_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_notifications(session, flush_context):
+    user_ids = {obj.user_id for obj in session.new if isinstance(obj, Notification)}
+    if user_ids:
+        session.info.setdefault('notify_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_committed(session):
+    everyone = session.info.pop('notify_everyone', False)
+    user_ids = session.info.pop('notify_users', None)
+    if everyone:
+        bus.publish(None)
+    elif user_ids:
+        bus.publish(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('notify_everyone', None)
+    session.info.pop('notify_users', None)
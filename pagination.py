@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque token"""
+    raw = json.dumps(list(values), separators=(',', ':'), default=_encode_value)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+def get_limit(default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+
+def wants_flag(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def keyset_filter(columns, values, descending=False):
+    """Match rows that sort strictly after `values` in `columns` order"""
+    if len(values) != len(columns):
+        raise InvalidCursor(values)
+    values = [_coerce(column, value) for column, value in zip(columns, values)]
+    after = (lambda column, value: column < value) if descending else (lambda column, value: column > value)
+    clause = after(columns[-1], values[-1])
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        clause = or_(after(column, value), and_(column == value, clause))
+    return clause
+
+
+def _coerce(column, value):
+    # Cursors round-trip through JSON, so datetimes come back as ISO strings
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is datetime and isinstance(value, str):
+            return datetime.fromisoformat(value)
+        if python_type in (int, float) and not isinstance(value, (int, float)):
+            raise InvalidCursor(value)
+    except ValueError:
+        raise InvalidCursor(value)
+    return value
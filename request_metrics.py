@@ -0,0 +1,256 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-endpoint request latency and SQL statement counts, served in the
+# Prometheus text format. Every worker keeps its own counters and, when
+# METRICS_DIR is set, snapshots them to METRICS_DIR/<pid>.json at most once per
+# METRICS_FLUSH_SECONDS; the metrics endpoint adds up all snapshots, so any
+# worker can answer a scrape for the whole server. A worker removes its
+# snapshot when it exits, and snapshots of processes that are gone (killed
+# before they could) are skipped and removed, so the pool gauges only count
+# live workers; the counters reset as they would on a restart.
+#
+# Event streams (SSE) stay open for as long as the client listens, so their
+# durations go to a histogram of their own instead of the request latency.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+STREAM_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 14400)
+EVENT_STREAM = 'text/event-stream'
+MAX_CAPTURED_STATEMENTS = 50
+
+
+def _histogram(buckets):
+    return {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+
+
+def _observe(histogram, buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            histogram['buckets'][i] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_count' in g:
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if not started or not has_request_context() or 'sql_count' not in g:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    g.sql_count += 1
+    g.sql_seconds += elapsed
+    if g.sql_statements is not None and len(g.sql_statements) < MAX_CAPTURED_STATEMENTS:
+        g.sql_statements.append((round(elapsed * 1000, 2), statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _abandon_statement(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    # so the next statement on this connection isn't timed from it
+    connection = context.connection
+    started = connection.info.get('statement_started') if connection is not None else None
+    if started:
+        started.pop()
+
+
+class RequestMetrics:
+    """Extension recording request latency and SQL usage per endpoint"""
+
+    def __init__(self, pool_stats=None, app=None):
+        self.pool_stats = pool_stats or dict
+        self.directory = None
+        self.flush_seconds = 1.0
+        self.slow_seconds = 0
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_seconds = app.config.get('METRICS_FLUSH_SECONDS', self.flush_seconds)
+        self.slow_seconds = app.config.get('SLOW_REQUEST_SECONDS', 0)
+        self.logger = app.logger
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self._remove_snapshot)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._last_flush = 0.0
+        self.data = {'requests': {}, 'latency': {}, 'stream_duration': {}, 'sql_queries': {}, 'sql_seconds': {}}
+
+    def _start_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = [] if self.slow_seconds else None
+
+    def _finish_request(self, response):
+        if 'request_started' not in g:
+            return response
+        # Streamed bodies keep running queries after this hook, so record on close
+        endpoint, method, path = request.endpoint or 'unmatched', request.method, request.full_path.rstrip('?')
+        state = g._get_current_object()
+        event_stream = response.mimetype == EVENT_STREAM
+        response.call_on_close(lambda: self._record(state, endpoint, method, path, response.status_code, event_stream))
+        return response
+
+    def _record(self, state, endpoint, method, path, status, event_stream=False):
+        elapsed = time.perf_counter() - state.request_started
+        durations, buckets = ('stream_duration', STREAM_BUCKETS) if event_stream else ('latency', LATENCY_BUCKETS)
+        route = f'{endpoint}|{method}'
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()  # forked worker: don't count the parent's requests twice
+            requests = self.data['requests']
+            requests[f'{route}|{status}'] = requests.get(f'{route}|{status}', 0) + 1
+            _observe(self.data[durations].setdefault(route, _histogram(buckets)), buckets, elapsed)
+            _observe(self.data['sql_queries'].setdefault(route, _histogram(QUERY_BUCKETS)), QUERY_BUCKETS, state.sql_count)
+            self.data['sql_seconds'][route] = self.data['sql_seconds'].get(route, 0) + state.sql_seconds
+            due = self.directory and time.monotonic() - self._last_flush >= self.flush_seconds
+
+        if due:
+            self.flush()
+        if self.slow_seconds and elapsed >= self.slow_seconds and not event_stream:
+            self.logger.warning(
+                'Slow request %s %s -> %s in %.0f ms, %d SQL statement(s) in %.0f ms:\n%s',
+                method, path, status, elapsed * 1000, state.sql_count, state.sql_seconds * 1000,
+                '\n'.join(f'  [{ms} ms] {statement}' for ms, statement in state.sql_statements)
+            )
+
+    def snapshot(self):
+        with self._lock:
+            data = json.loads(json.dumps(self.data))
+        data['pool'] = self.pool_stats()
+        return data
+
+    def flush(self):
+        """Write this worker's counters to METRICS_DIR"""
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        path = self._snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _remove_snapshot(self, pid=None):
+        try:
+            os.remove(self._snapshot_path(pid or os.getpid()))
+        except OSError:
+            pass
+
+    def collect(self):
+        """Counters of every worker (or just this one without METRICS_DIR), added up"""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        total = {'requests': {}, 'latency': {}, 'stream_duration': {}, 'sql_queries': {}, 'sql_seconds': {}, 'pool': {}}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            pid = os.path.basename(path)[:-len('.json')]
+            if pid.isdigit() and not _process_alive(int(pid)):
+                self._remove_snapshot(pid)
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name in ('requests', 'sql_seconds'):
+                for key, value in data[name].items():
+                    total[name][key] = total[name].get(key, 0) + value
+            for name in ('latency', 'stream_duration', 'sql_queries'):
+                for key, histogram in data.get(name, {}).items():
+                    merged = total[name].setdefault(key, {'buckets': [0] * len(histogram['buckets']), 'sum': 0, 'count': 0})
+                    merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+                    merged['sum'] += histogram['sum']
+                    merged['count'] += histogram['count']
+            for bind, stats in data.get('pool', {}).items():
+                merged = total['pool'].setdefault(bind, {})
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)) and not key.endswith('_max'):
+                        merged[key] = merged.get(key, 0) + value
+                    elif key.endswith('_max'):
+                        merged[key] = max(merged.get(key, 0), value)
+        return total
+
+    def render(self):
+        """The collected counters in the Prometheus text exposition format"""
+        data = self.collect()
+        lines = [
+            '# HELP library_http_requests_total Requests served, by endpoint, method and status.',
+            '# TYPE library_http_requests_total counter',
+        ]
+        for key, value in sorted(data['requests'].items()):
+            endpoint, method, status = key.split('|')
+            lines.append(f'library_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {value}')
+
+        lines += _render_histogram(
+            'library_http_request_duration_seconds', 'Request latency in seconds.',
+            data['latency'], LATENCY_BUCKETS
+        )
+        lines += _render_histogram(
+            'library_http_stream_duration_seconds', 'How long event streams stayed open, in seconds.',
+            data['stream_duration'], STREAM_BUCKETS
+        )
+        lines += _render_histogram(
+            'library_http_request_sql_queries', 'SQL statements run per request.',
+            data['sql_queries'], QUERY_BUCKETS
+        )
+
+        lines += [
+            '# HELP library_sql_duration_seconds_total Time spent in SQL statements during requests.',
+            '# TYPE library_sql_duration_seconds_total counter',
+        ]
+        for key, value in sorted(data['sql_seconds'].items()):
+            endpoint, method = key.split('|')
+            lines.append(f'library_sql_duration_seconds_total{{endpoint="{endpoint}",method="{method}"}} {value:.6f}')
+
+        for bind, stats in sorted(data['pool'].items()):
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f'library_db_pool_{key}{{bind="{bind}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # alive, owned by another user
+    return True
+
+
+def _render_histogram(name, help_text, histograms, buckets):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items()):
+        endpoint, method = key.split('|')
+        labels = f'endpoint="{endpoint}",method="{method}"'
+        for bound, count in zip(buckets, histogram['buckets']):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{{labels}}} {round(histogram["sum"], 6)}')
+        lines.append(f'{name}_count{{{labels}}} {histogram["count"]}')
+    return lines
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+from models import Book, BookBorrowDaily, Borrowing
+
+WINDOWS = {
+    '7d': 7,
+    '30d': 30,
+    'all': None,
+}
+
+
+def record_borrow(book_id, day=None):
+    """Count one borrowing of `book_id` in the daily rollup (same transaction as the borrowing)"""
+    dialect_name = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+    statement = insert(BookBorrowDaily).values(
+        book_id=book_id,
+        day=day or datetime.utcnow().date(),
+        borrow_count=1
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[BookBorrowDaily.book_id, BookBorrowDaily.day],
+        set_={'borrow_count': BookBorrowDaily.borrow_count + statement.excluded.borrow_count}
+    ))
+
+
+def rebuild_borrow_rollup():
+    """Recompute the whole rollup from the borrowings table; returns the number of rows"""
+    day = db.func.date(Borrowing.borrowed_at)
+    db.session.execute(db.delete(BookBorrowDaily))
+    db.session.execute(db.insert(BookBorrowDaily).from_select(
+        ['book_id', 'day', 'borrow_count'],
+        db.select(Borrowing.book_id, day, db.func.count()).group_by(Borrowing.book_id, day)
+    ))
+    rows = db.session.query(db.func.count()).select_from(BookBorrowDaily).scalar()
+    db.session.commit()
+    return rows
+
+
+def most_borrowed_books(days=None, category=None, limit=10):
+    """Most borrowed books over the last `days` days (all time when None)"""
+    borrow_count = db.func.sum(BookBorrowDaily.borrow_count).label('borrow_count')
+    query = db.session.query(
+        Book.id,
+        Book.title,
+        Book.author,
+        Book.category,
+        borrow_count
+    ).join(BookBorrowDaily, BookBorrowDaily.book_id == Book.id)
+    
+    if days:
+        query = query.filter(BookBorrowDaily.day > datetime.utcnow().date() - timedelta(days=days))
+    if category:
+        query = query.filter(Book.category == category)
+    
+    return query.group_by(Book.id, Book.title, Book.author, Book.category).order_by(
+        borrow_count.desc(), Book.id
+    ).limit(limit).all()
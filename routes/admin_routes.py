@@ -1,29 +1,40 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt
-from models import Book, User, Borrowing, Notification, Reservation
+from models import Book, User, Borrowing, Reservation
 from decorators import admin_required
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from extensions import db, jwt
+from datetime import datetime
+from extensions import db, jwt, cache, pool_monitor
+from jobs import send_due_reminders
+from borrowing_history import borrowing_counts, history_page
+from exports import FORMATS as EXPORT_FORMATS, parse_date_range, stream_export
+from rollups import WINDOWS, most_borrowed_books
+from serializers import RESERVATION_REPORT
+from token_blocklist import revoke_user_tokens
+from pagination import InvalidCursor, decode_cursor, encode_cursor, get_limit, keyset_filter
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
 @admin_bp.route('/reports/popular-books', methods=['GET'])
 @admin_required
 def popular_books():
-    results = db.session.query(
-        Book.id,
-        Book.title,
-        Book.author,
-        func.count(Borrowing.id).label('borrow_count')
-    ).join(Borrowing).group_by(Book.id).order_by(func.count(Borrowing.id).desc()).limit(10).all()
+    window = request.args.get('window', 'all')
+    if window not in WINDOWS:
+        return jsonify({'error': f"window must be one of {', '.join(WINDOWS)}"}), 400
+    
+    results = most_borrowed_books(
+        days=WINDOWS[window],
+        category=request.args.get('category'),
+        limit=get_limit(default=10, maximum=100)
+    )
     
     return jsonify({
+        'window': window,
         'popular_books': [
             {
                 'id': r.id,
                 'title': r.title,
                 'author': r.author,
+                'category': r.category,
                 'borrow_count': r.borrow_count
             }
             for r in results
@@ -34,34 +45,39 @@ def popular_books():
 @admin_bp.route('/reports/overdue-books', methods=['GET'])
 @admin_required
 def overdue_books():
-    overdue = Borrowing.query.filter(
+    """Read-only overdue report, most overdue first; flagging and notifying is done by `flask sweep-overdue`"""
+    now = datetime.utcnow()
+    sort_columns = [Borrowing.due_date, Borrowing.id]
+    
+    query = Borrowing.query.join(Borrowing.book).join(Borrowing.user).options(
+        db.contains_eager(Borrowing.book),
+        db.contains_eager(Borrowing.user)
+    ).filter(
         Borrowing.returned_at.is_(None),
-        Borrowing.due_date < datetime.utcnow()
-    ).all()
-    
-    # Mark as overdue
-    for borrowing in overdue:
-        if not borrowing.is_overdue:
-            borrowing.is_overdue = True
-            # Create notification
-            notification = Notification(
-                user_id=borrowing.user_id,
-                message=f'\"{borrowing.book.title}\" is overdue. Please return it as soon as possible.',
-                type='overdue'
-            )
-            db.session.add(notification)
-    
-    db.session.commit()
+        Borrowing.due_date < now
+    )
+    
+    if request.args.get('after'):
+        try:
+            query = query.filter(keyset_filter(sort_columns, decode_cursor(request.args['after'])))
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    limit = get_limit()
+    overdue = query.order_by(*sort_columns).limit(limit + 1).all()
+    has_more = len(overdue) > limit
+    overdue = overdue[:limit]
     
     return jsonify({
         'overdue_books': [
             {
                 'borrowing': b.to_dict(),
                 'user': b.user.to_dict(),
-                'days_overdue': (datetime.utcnow() - b.due_date).days
+                'days_overdue': (now - b.due_date).days
             }
             for b in overdue
-        ]
+        ],
+        'next_cursor': encode_cursor([overdue[-1].due_date, overdue[-1].id]) if has_more else None
     }), 200
 
 
@@ -73,78 +89,128 @@ def user_borrowing_history(user_id):
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    borrowings = Borrowing.query.filter_by(user_id=user_id).order_by(Borrowing.borrowed_at.desc()).all()
+    try:
+        history = history_page(user_id, request.args.get('after'))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
     return jsonify({
         'user': user.to_dict(),
-        'borrowing_history': [b.to_dict() for b in borrowings],
-        'total_borrowed': len(borrowings),
-        'currently_borrowed': len([b for b in borrowings if not b.returned_at])
+        **history,
+        **borrowing_counts(user_id)
     }), 200
 
 
+@admin_bp.route('/users/<int:user_id>/revoke-sessions', methods=['POST'])
+@admin_required
+def revoke_user_sessions(user_id):
+    """Revoke every token of a user, e.g. after changing their role"""
+    user = User.query.get(user_id)
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    revoke_user_tokens(user.id)
+    
+    return jsonify({'message': f'All sessions of {user.email} revoked'}), 200
+
+
 @admin_bp.route('/reservations', methods=['GET'])
 @admin_required
 def get_all_reservations():
-    reservations = db.session.query(Reservation, User, Book).join(User, Reservation.user_id == User.id).join(Book, Reservation.book_id == Book.id).order_by(
+    rows = db.session.execute(RESERVATION_REPORT.select().order_by(
             db.case(
                 (Reservation.status == 'active', 0),
                 else_=1
             ),
             Reservation.reserved_at.desc()
-        ).all()
+        ))
+    
+    return jsonify({'reservations': RESERVATION_REPORT.to_dicts(rows)}), 200
+
 
-    response_data = []
-    for reservation, user, book in reservations:
-        response_data.append({
-            'reservation_id': reservation.id,
-            'user_id': user.id,
-            'user_name': user.name,
-            'user_email': user.email,
-            'reservation_status': reservation.status,
-            'reserved_at': reservation.reserved_at.isoformat(),
-            'expires_at': reservation.expires_at.isoformat(),
-            'book_id': book.id,
-            'book_title': book.title
-        })
+@admin_bp.route('/exports/reservations', methods=['GET'])
+@admin_required
+def export_reservations():
+    """Stream every reservation as CSV or NDJSON (`format`), optionally within `from`/`to` reserved_at bounds"""
+    return _export(
+        db.select(
+            Reservation.id.label('reservation_id'),
+            User.id.label('user_id'),
+            User.name.label('user_name'),
+            User.email.label('user_email'),
+            Reservation.status.label('reservation_status'),
+            Reservation.reserved_at,
+            Reservation.expires_at,
+            Book.id.label('book_id'),
+            Book.title.label('book_title')
+        ).join(User, Reservation.user_id == User.id).join(Book, Reservation.book_id == Book.id).order_by(Reservation.id),
+        Reservation.reserved_at,
+        'reservations'
+    )
+
+
+@admin_bp.route('/exports/borrowings', methods=['GET'])
+@admin_required
+def export_borrowings():
+    """Stream every borrowing as CSV or NDJSON (`format`), optionally within `from`/`to` borrowed_at bounds"""
+    return _export(
+        db.select(
+            Borrowing.id.label('borrowing_id'),
+            User.id.label('user_id'),
+            User.name.label('user_name'),
+            User.email.label('user_email'),
+            Book.id.label('book_id'),
+            Book.title.label('book_title'),
+            Borrowing.borrowed_at,
+            Borrowing.due_date,
+            Borrowing.returned_at,
+            Borrowing.is_overdue
+        ).join(User, Borrowing.user_id == User.id).join(Book, Borrowing.book_id == Book.id).order_by(Borrowing.id),
+        Borrowing.borrowed_at,
+        'borrowings'
+    )
+
+
+def _export(statement, date_column, filename):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    
+    try:
+        start, end = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+    
+    if start:
+        statement = statement.where(date_column >= start)
+    if end:
+        statement = statement.where(date_column < end)
     
-    return jsonify({'reservations': response_data}), 200
+    return stream_export(statement, fmt, filename)
+
+
+@admin_bp.route('/cache-stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Hit/miss/eviction counters of this worker's catalog cache"""
+    return jsonify(cache.stats), 200
+
+
+@admin_bp.route('/pool-stats', methods=['GET'])
+@admin_required
+def pool_stats():
+    """Connection pool counters of this worker, per database"""
+    return jsonify(pool_monitor.stats), 200
 
 
 @admin_bp.route('/check-due-dates', methods=['POST'])
 @admin_required
 def check_due_dates():
     """Check for books due within 3 days and send notifications"""
-    upcoming_due = Borrowing.query.filter(
-        Borrowing.returned_at.is_(None),
-        Borrowing.due_date <= datetime.utcnow() + timedelta(days=3),
-        Borrowing.due_date > datetime.utcnow()
-    ).all()
-    
-    notifications_created = 0
-    for borrowing in upcoming_due:
-        # Check if notification already exists
-        existing = Notification.query.filter_by(
-            user_id=borrowing.user_id,
-            type='due_date',
-            is_read=False
-        ).filter(
-            Notification.message.like(f'%{borrowing.book.title}%')
-        ).first()
-        
-        if not existing:
-            days_remaining = (borrowing.due_date - datetime.utcnow()).days
-            notification = Notification(
-                user_id=borrowing.user_id,
-                message=f'Reminder: \"{borrowing.book.title}\" is due in {days_remaining} day(s).',
-                type='due_date'
-            )
-            db.session.add(notification)
-            notifications_created += 1
-    
-    db.session.commit()
+    metrics = send_due_reminders()
     
     return jsonify({
-        'message': f'{notifications_created} notifications created',
-        'upcoming_due_count': len(upcoming_due)
+        'message': f"{metrics['notifications_created']} notifications created",
+        'upcoming_due_count': metrics['upcoming_due']
     }), 200
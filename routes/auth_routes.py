@@ -1,7 +1,11 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
-from models import User, Borrowing
+from models import User
 from extensions import db, jwt
+from hashing import HashingBusy
+from borrowing_history import history_page
+from pagination import InvalidCursor
+from token_blocklist import revoke_token, revoke_user_tokens
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
@@ -43,6 +47,14 @@ def login():
     if not user or not user.check_password(data['password']):
         return jsonify({'error': 'Invalid credentials'}), 401
     
+    # Upgrade hashes made with an older method or cost; retried next login if busy
+    if user.password_needs_rehash():
+        try:
+            user.set_password(data['password'])
+            db.session.commit()
+        except HashingBusy:
+            pass
+    
     access_token = create_access_token(
         identity=str(user.id),
         additional_claims={'role': user.role}
@@ -54,6 +66,23 @@ def login():
     }), 200
 
 
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    revoke_token(get_jwt())
+    
+    return jsonify({'message': 'Logged out'}), 200
+
+
+@auth_bp.route('/logout-all', methods=['POST'])
+@jwt_required()
+def logout_all():
+    """Revoke every token of the current user, on all devices"""
+    revoke_user_tokens(int(get_jwt_identity()))
+    
+    return jsonify({'message': 'All sessions revoked'}), 200
+
+
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
@@ -63,12 +92,15 @@ def get_profile():
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    # Get borrowing history
-    borrowings = Borrowing.query.filter_by(user_id=user_id).order_by(Borrowing.borrowed_at.desc()).all()
+    # Get borrowing history, one page at a time
+    try:
+        history = history_page(user_id, request.args.get('after'))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
     return jsonify({
         'user': user.to_dict(),
-        'borrowing_history': [b.to_dict() for b in borrowings]
+        **history
     }), 200
 
 
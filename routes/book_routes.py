@@ -1,46 +1,180 @@
-from flask import Blueprint, request, jsonify
+from urllib.parse import urlencode
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from models import Book
+from catalog_import import BATCH_SIZE, FORMATS, import_books, iter_rows
+from pagination import InvalidCursor, decode_cursor, encode_cursor, get_limit, keyset_filter, wants_flag
+from search import apply_search, search_tokens
+from typeahead import index as typeahead_index
+from facets import catalog_facets, filtered_facets
+from catalog_cache import CATALOG_TAG, book_tag
+from inventory import promote_holds
 from decorators import admin_required
-from extensions import db, jwt
+from extensions import db, jwt, cache
+from serializers import BOOK
 
 book_bp = Blueprint('book', __name__, url_prefix='/api/books')
 
 @book_bp.route('', methods=['GET'])
 def get_books():
-    # Search and filter
-    query = Book.query
+    streaming = request.args.get('format') == 'ndjson'
+    if not streaming:
+        cache_key = _listing_cache_key()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return jsonify(cached), 200
+    
+    query, rank = _apply_filters(BOOK.select())
+    
+    sort = request.args.get('sort', 'relevance' if rank is not None else 'title')
+    if sort == 'relevance' and rank is not None:
+        sort_columns = [rank, Book.id]
+    elif sort in SORT_COLUMNS:
+        sort_columns = SORT_COLUMNS[sort]
+    else:
+        return jsonify({'error': 'Invalid sort'}), 400
+    
+    total = None
+    if wants_flag('include_total'):
+        total = db.session.scalar(db.select(db.func.count()).select_from(query.order_by(None).subquery()))
+    
+    # Keyset pagination: continue strictly after the last row of the previous page
+    if request.args.get('after'):
+        try:
+            query = query.filter(keyset_filter(sort_columns, decode_cursor(request.args['after'])))
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    query = query.add_columns(*sort_columns).order_by(*sort_columns)
+    
+    if streaming:
+        return _stream_books(query)
+    
+    limit = get_limit()
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    books = BOOK.to_dicts(rows)
+    # Tag with the look-ahead row too: it decides whether there is a next page
+    tags = [CATALOG_TAG] + [book_tag(book['id']) for book in books]
+    
+    response = {
+        'books': books[:limit],
+        'next_cursor': encode_cursor(rows[limit - 1][-len(sort_columns):]) if has_more else None
+    }
+    if total is not None:
+        response['total'] = total
+    
+    cache.set(cache_key, response, tags=tags)
+    
+    return jsonify(response), 200
+
+
+def _apply_filters(query):
+    """Apply the search, category and author filters; returns (query, search rank or None)"""
+    rank = None
     
     if request.args.get('search'):
-        search = f"%{request.args.get('search')}%"
-        query = query.filter(
-            db.or_(
-                Book.title.ilike(search),
-                Book.author.ilike(search)
-            )
-        )
+        query, rank = apply_search(query, request.args['search'])
     
     if request.args.get('category'):
-        query = query.filter_by(category=request.args.get('category'))
+        query = query.filter(Book.category == request.args.get('category'))
     
-    if request.args.get('author'):
-        query = query.filter(Book.author.ilike(f"%{request.args.get('author')}%"))
+    author = _author_filter()
+    if author:
+        query = query.filter(Book.author.ilike(f'%{author}%'))
     
-    books = query.all()
+    return query, rank
+
+
+def _author_filter():
+    """The author filter as applied and as keyed in the cache, surrounding spaces ignored"""
+    return (request.args.get('author') or '').strip()
+
+
+def _listing_cache_key():
+    """Cache key for a listing request, normalized so equivalent filters share an entry"""
+    search = request.args.get('search')
+    params = {
+        'search': ' '.join(search_tokens(search)) if search else None,
+        'category': request.args.get('category') or None,
+        'author': _author_filter() or None,
+        'sort': request.args.get('sort'),
+        'after': request.args.get('after'),
+        'limit': get_limit(),
+        'include_total': wants_flag('include_total')
+    }
+    return 'books:' + urlencode(sorted(params.items()))
+
+
+SORT_COLUMNS = {
+    'title': [Book.title, Book.id],
+    'id': [Book.id]
+}
+
+STREAM_CHUNK_SIZE = 1000
+
+
+def _stream_books(query):
+    def generate():
+        rows = db.session.execute(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for row in rows:
+            yield current_app.json.dumps(BOOK.to_dict(row)) + '\n'
     
-    return jsonify({
-        'books': [book.to_dict() for book in books],
-        'total': len(books)
-    }), 200
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@book_bp.route('/facets', methods=['GET'])
+def get_facets():
+    """Counts per category, top authors and availability for the books the
+    search/category/author filters select (the whole catalog without filters)"""
+    authors_limit = min(max(request.args.get('authors_limit', DEFAULT_AUTHOR_FACETS, type=int), 1), MAX_AUTHOR_FACETS)
+    filtered = any(request.args.get(name) for name in ('search', 'category', 'author'))
+    
+    if not filtered:
+        facets = catalog_facets(authors_limit)
+    else:
+        query, _ = _apply_filters(db.select(Book.id))
+        facets = filtered_facets(query, authors_limit)
+    
+    return jsonify(facets), 200
+
+
+DEFAULT_AUTHOR_FACETS = 10
+MAX_AUTHOR_FACETS = 100
+
+
+@book_bp.route('/typeahead', methods=['GET'])
+def typeahead():
+    """Suggestions for the search box: books with title, author or ISBN words
+    starting with every word typed, answered from an in-memory prefix index"""
+    term = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', DEFAULT_SUGGESTIONS, type=int), 1), MAX_SUGGESTIONS)
+    
+    suggestions = typeahead_index.suggest(term, limit)
+    if suggestions is None:
+        # Index still loading: answer from the search index instead
+        query, rank = apply_search(db.select(Book.id, Book.title, Book.author, Book.isbn), term)
+        rows = db.session.execute(query.order_by(rank).limit(limit)).all()
+        suggestions = [{'id': id, 'title': title, 'author': author, 'isbn': isbn} for id, title, author, isbn in rows]
+    
+    return jsonify({'suggestions': suggestions}), 200
+
+
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
 
 
 @book_bp.route('/<int:book_id>', methods=['GET'])
 def get_book(book_id):
-    book = Book.query.get(book_id)
+    def load():
+        book = Book.query.get(book_id)
+        return book.to_dict() if book else None
+    
+    book = cache.get_or_set(f'book-detail:{book_id}', load, tags=[book_tag(book_id)])
     
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
-    return jsonify(book.to_dict()), 200
+    return jsonify(book), 200
 
 
 @book_bp.route('', methods=['POST'])
@@ -70,15 +204,49 @@ def create_book():
     }), 201
 
 
+@book_bp.route('/import', methods=['POST'])
+@admin_required
+def import_books_endpoint():
+    """Bulk upsert books (keyed on ISBN) from a streamed CSV or NDJSON body"""
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in FORMATS:
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    def log_progress(report):
+        current_app.logger.info(
+            'Book import: %d rows processed (%s rows/s)', report['processed'], report['rows_per_second']
+        )
+    
+    report = import_books(
+        iter_rows(request.stream, fmt),
+        batch_size=request.args.get('batch_size', BATCH_SIZE, type=int),
+        progress=log_progress
+    )
+    
+    return jsonify({
+        'message': f"{report['imported']} books imported, {report['failed']} rejected",
+        'report': report
+    }), 200
+
+
 @book_bp.route('/<int:book_id>', methods=['PUT'])
 @admin_required
 def update_book(book_id):
-    book = Book.query.get(book_id)
+    # Locked, so the copies it replaces are the ones the facet counts move from
+    book = Book.query.with_for_update().filter_by(id=book_id).first()
     data = request.get_json()
     
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
+    for field in ('total_copies', 'available_copies'):
+        value = data.get(field)
+        if field in data and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return jsonify({'error': f'{field} must be a non-negative integer'}), 400
+    
+    shelved = book.available_copies or 0
     if data.get('title'):
         book.title = data['title']
     if data.get('author'):
@@ -93,6 +261,10 @@ def update_book(book_id):
         book.available_copies = data['available_copies']
     if data.get('description'):
         book.description = data['description']
+    if book.available_copies > shelved:
+        # Copies added by hand go to patrons waiting in the hold queue first
+        db.session.flush()
+        promote_holds(book.id, book.available_copies - shelved)
     
     db.session.commit()
     
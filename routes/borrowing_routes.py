@@ -1,9 +1,15 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from models import Book, User, Borrowing, Reservation, Notification
+from models import LOAN_DAYS, Book, User, Borrowing, Reservation, Notification
 from decorators import admin_required
 from datetime import datetime, timedelta
 from extensions import db, jwt
+from rollups import record_borrow
+from inventory import (
+    close_borrowing, close_borrowings, close_reservation, leave_queue, promote_holds, release_reservation_count,
+    restore_copy, take_copy
+)
+from serializers import BORROWING
 
 borrowing_bp = Blueprint('borrowing', __name__, url_prefix='/api/borrowings')
 
@@ -21,42 +27,149 @@ def create_borrowing():
     if not book or not user:
         return jsonify({'error': 'Book or user not found'}), 404
     
-    # Check for active reservation
-    reservation = Reservation.query.filter_by(
-        user_id=user.id,
-        book_id=book.id,
-        status='active'
-    ).first()
+    # Check for an active or queued reservation
+    reservation = Reservation.query.filter(
+        Reservation.user_id == user.id,
+        Reservation.book_id == book.id,
+        Reservation.status.in_(('active', 'queued'))
+    ).order_by(Reservation.status).first()
     
-    if reservation:
-        reservation.status = 'fulfilled'
-    elif book.available_copies <= 0:
+    borrowing = _check_out(user, book, reservation)
+    if not borrowing:
         return jsonify({'error': 'Book not available'}), 400
-    else:
-        book.available_copies -= 1
+    
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Book borrowed successfully',
+        'borrowing': borrowing.to_dict()
+    }), 201
+
+
+def _check_out(user, book, reservation=None):
+    """Lend a copy (fulfilling the user's reservation if any) and queue the notification.
+    
+    A queued hold is dropped from the queue, since the user no longer needs it.
+    Returns the pending Borrowing, or None when no copy is available.
+    """
+    if reservation and reservation.status == 'active' and close_reservation(reservation.id, 'fulfilled'):
+        release_reservation_count(book.id)
+    elif not take_copy(book.id):
+        return None
+    elif reservation and reservation.status == 'queued':
+        leave_queue(reservation.id, book.id)
     
     borrowing = Borrowing(
         user_id=user.id,
         book_id=book.id,
-        due_date=datetime.utcnow() + timedelta(days=14)
+        due_date=datetime.utcnow() + timedelta(days=LOAN_DAYS)
     )
-    
     db.session.add(borrowing)
-    db.session.commit()
+    record_borrow(book.id)
     
     # Create notification
     notification = Notification(
         user_id=user.id,
         message=f'You have borrowed "{book.title}". Due date: {borrowing.due_date.strftime("%Y-%m-%d")}',
-        type='due_date'
+        type='due_date',
+        borrowing=borrowing,
+        kind='borrowed'
     )
     db.session.add(notification)
+    
+    return borrowing
+
+
+def _is_id(value):
+    # bool is an int subclass, and JSON true must not pass for id 1
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _batch_items(data, key):
+    if not isinstance(data, dict) or not isinstance(data.get(key), list) or not data[key]:
+        return None, (jsonify({'error': f'{key} must be a non-empty list'}), 400)
+    if len(data[key]) > MAX_BATCH_ITEMS:
+        return None, (jsonify({'error': f'At most {MAX_BATCH_ITEMS} items per batch'}), 400)
+    if data.get('mode', 'atomic') not in ('atomic', 'partial'):
+        return None, (jsonify({'error': "mode must be 'atomic' or 'partial'"}), 400)
+    return data[key], None
+
+
+MAX_BATCH_ITEMS = 200
+
+
+@borrowing_bp.route('/batch', methods=['POST'])
+@admin_required
+def create_borrowings_batch():
+    """Check out many books in one transaction.
+    
+    Body: {"items": [{"user_id": .., "book_id": ..}, ..], "mode": "atomic" | "partial"}.
+    In atomic mode (the default) nothing is saved unless every item succeeds.
+    """
+    data = request.get_json()
+    items, error = _batch_items(data, 'items')
+    if error:
+        return error
+    atomic = data.get('mode', 'atomic') == 'atomic'
+    
+    pairs = []
+    for item in items:
+        if isinstance(item, dict) and _is_id(item.get('user_id')) and _is_id(item.get('book_id')):
+            pairs.append((item['user_id'], item['book_id']))
+        else:
+            pairs.append(None)
+    user_ids = {pair[0] for pair in pairs if pair}
+    book_ids = {pair[1] for pair in pairs if pair}
+    
+    # Resolve everything up front: three queries regardless of batch size
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids))}
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids))}
+    reservations = {
+        (r.user_id, r.book_id): r
+        for r in Reservation.query.filter(
+            Reservation.status.in_(('active', 'queued')),
+            Reservation.user_id.in_(user_ids),
+            Reservation.book_id.in_(book_ids)
+        ).order_by(Reservation.status.desc())  # an active hold wins over a queued one
+    }
+    
+    results = []
+    for index, pair in enumerate(pairs):
+        if not pair:
+            results.append({'index': index, 'error': 'user_id and book_id must be integers'})
+            continue
+        user, book = users.get(pair[0]), books.get(pair[1])
+        if not user or not book:
+            results.append({'index': index, 'error': 'Book or user not found'})
+            continue
+        
+        # A reservation can only be fulfilled once per batch
+        borrowing = _check_out(user, book, reservations.pop(pair, None))
+        if not borrowing:
+            results.append({'index': index, 'error': 'Book not available'})
+            continue
+        results.append({'index': index, 'borrowing': borrowing})
+    
+    failed = sum(1 for result in results if 'error' in result)
+    if atomic and failed:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Batch rejected',
+            'results': [result for result in results if 'error' in result]
+        }), 409
+    
+    # Serialize before committing so the expired rows aren't reloaded one by one
+    db.session.flush()
+    for result in results:
+        if 'borrowing' in result:
+            result['borrowing'] = result['borrowing'].to_dict()
+    
     db.session.commit()
     
     return jsonify({
-        'message': 'Book borrowed successfully',
-        'borrowing': borrowing.to_dict()
-    }), 201
+        'message': f'{len(results) - failed} books borrowed, {failed} failed',
+        'results': results
+    }), 200
 
 
 @borrowing_bp.route('', methods=['GET'])
@@ -65,13 +178,12 @@ def get_borrowings():
     user_id = int(get_jwt_identity())
     claims = get_jwt()
     
-    if claims.get('role') == 'admin':
-        borrowings = Borrowing.query.order_by(Borrowing.borrowed_at.desc()).all()
-    else:
-        borrowings = Borrowing.query.filter_by(user_id=user_id).order_by(Borrowing.borrowed_at.desc()).all()
+    query = BORROWING.select().order_by(Borrowing.borrowed_at.desc())
+    if claims.get('role') != 'admin':
+        query = query.where(Borrowing.user_id == user_id)
     
     return jsonify({
-        'borrowings': [b.to_dict() for b in borrowings]
+        'borrowings': BORROWING.to_dicts(db.session.execute(query))
     }), 200
 
 
@@ -83,11 +195,11 @@ def return_book(borrowing_id):
     if not borrowing:
         return jsonify({'error': 'Borrowing record not found'}), 404
     
-    if borrowing.returned_at:
+    if not close_borrowing(borrowing.id):
         return jsonify({'error': 'Book already returned'}), 400
     
-    borrowing.returned_at = datetime.utcnow()
-    borrowing.book.available_copies += 1
+    restore_copy(borrowing.book_id)
+    promote_holds(borrowing.book_id)
     
     db.session.commit()
     
@@ -95,3 +207,67 @@ def return_book(borrowing_id):
         'message': 'Book returned successfully',
         'borrowing': borrowing.to_dict()
     }), 200
+
+
+@borrowing_bp.route('/batch-return', methods=['POST'])
+@admin_required
+def return_books_batch():
+    """Return many borrowings in one transaction.
+    
+    Body: {"borrowing_ids": [..], "mode": "atomic" | "partial"}.
+    """
+    data = request.get_json()
+    borrowing_ids, error = _batch_items(data, 'borrowing_ids')
+    if error:
+        return error
+    if not all(_is_id(borrowing_id) for borrowing_id in borrowing_ids):
+        return jsonify({'error': 'borrowing_ids must be integers'}), 400
+    atomic = data.get('mode', 'atomic') == 'atomic'
+    
+    borrowings = {
+        b.id: b
+        for b in Borrowing.query.options(db.joinedload(Borrowing.book)).filter(Borrowing.id.in_(borrowing_ids))
+    }
+    closed = close_borrowings([b.id for b in borrowings.values() if not b.returned_at])
+    
+    results = []
+    returned_per_book = {}
+    returned = set()
+    for index, borrowing_id in enumerate(borrowing_ids):
+        borrowing = borrowings.get(borrowing_id)
+        if not borrowing:
+            results.append({'index': index, 'error': 'Borrowing record not found'})
+        elif borrowing.id in returned:
+            # Listing the same borrowing twice returns it once; the repeat succeeds as a no-op
+            results.append({'index': index, 'borrowing': borrowing, 'duplicate': True})
+        elif borrowing.id not in closed:
+            results.append({'index': index, 'error': 'Book already returned'})
+        else:
+            returned.add(borrowing.id)
+            returned_per_book[borrowing.book_id] = returned_per_book.get(borrowing.book_id, 0) + 1
+            results.append({'index': index, 'borrowing': borrowing})
+    
+    failed = sum(1 for result in results if 'error' in result)
+    if atomic and failed:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Batch rejected',
+            'results': [result for result in results if 'error' in result]
+        }), 409
+    
+    for book_id, count in returned_per_book.items():
+        restore_copy(book_id, count=count)
+        promote_holds(book_id, count)
+    
+    # Serialize before committing so the expired rows aren't reloaded one by one
+    db.session.flush()
+    for result in results:
+        if 'borrowing' in result:
+            result['borrowing'] = result['borrowing'].to_dict()
+    
+    db.session.commit()
+    
+    return jsonify({
+        'message': f'{len(returned)} books returned, {failed} failed',
+        'results': results
+    }), 200
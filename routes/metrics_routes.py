@@ -0,0 +1,31 @@
+import hmac
+from flask import Blueprint, Response, current_app, request
+from decorators import admin_required
+from extensions import request_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: request latency, SQL usage and pool counters of all workers.
+    
+    Needs the METRICS_TOKEN bearer token or an admin's access token.
+    """
+    if _has_scrape_token():
+        return _render()
+    return _render_for_admin()
+
+
+def _has_scrape_token():
+    token = current_app.config.get('METRICS_TOKEN')
+    supplied = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode())
+
+
+@admin_required
+def _render_for_admin():
+    return _render()
+
+
+def _render():
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,7 +1,12 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import Notification
-from extensions import db, jwt
+import notification_events  # noqa: F401  wakes streams when notifications are committed
+from extensions import db, jwt, bus
+from decorators import use_primary
+from serializers import NOTIFICATION
+from pagination import InvalidCursor, decode_cursor, encode_cursor, get_limit, keyset_filter, wants_flag
 
 notification_bp = Blueprint('notification', __name__, url_prefix='/api/notifications')
 
@@ -9,13 +14,66 @@ notification_bp = Blueprint('notification', __name__, url_prefix='/api/notificat
 @jwt_required()
 def get_notifications():
     user_id = int(get_jwt_identity())
-    notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
+    sort_columns = [Notification.created_at, Notification.id]
+    query = NOTIFICATION.select().where(Notification.user_id == user_id)
+    
+    if wants_flag('unread'):
+        query = query.where(Notification.is_read.is_(False))
+    
+    # Newest first; continue strictly after the last row of the previous page
+    if request.args.get('after'):
+        try:
+            query = query.filter(keyset_filter(sort_columns, decode_cursor(request.args['after']), descending=True))
+        except InvalidCursor:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    limit = get_limit()
+    rows = db.session.execute(query.order_by(*[column.desc() for column in sort_columns]).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    notifications = NOTIFICATION.to_dicts(rows[:limit])
     
     return jsonify({
-        'notifications': [n.to_dict() for n in notifications]
+        'notifications': notifications,
+        'next_cursor': encode_cursor([notifications[-1]['created_at'], notifications[-1]['id']]) if has_more else None
     }), 200
 
 
+@notification_bp.route('/unread-count', methods=['GET'])
+@jwt_required()
+def unread_count():
+    user_id = int(get_jwt_identity())
+    count = db.session.query(db.func.count(Notification.id)).filter(
+        Notification.user_id == user_id,
+        Notification.is_read.is_(False)
+    ).scalar()
+    
+    return jsonify({'unread': count}), 200
+
+
+@notification_bp.route('/read', methods=['POST'])
+@jwt_required()
+def mark_notifications_read():
+    """Mark all unread notifications read, or only those with id <= up_to_id"""
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    
+    query = Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.is_read.is_(False)
+    )
+    if data.get('up_to_id') is not None:
+        if not isinstance(data['up_to_id'], int) or isinstance(data['up_to_id'], bool):
+            return jsonify({'error': 'up_to_id must be an integer'}), 400
+        query = query.filter(Notification.id <= data['up_to_id'])
+    
+    updated = query.update({'is_read': True}, synchronize_session=False)
+    db.session.commit()
+    
+    return jsonify({'message': f'{updated} notifications marked as read', 'updated': updated}), 200
+
+
 @notification_bp.route('/<int:notification_id>/read', methods=['POST'])
 @jwt_required()
 def mark_notification_read(notification_id):
@@ -29,3 +87,69 @@ def mark_notification_read(notification_id):
     db.session.commit()
     
     return jsonify({'message': 'Notification marked as read'}), 200
+
+
+@notification_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+@use_primary
+def stream_notifications():
+    """Server-sent events stream of the user's new notifications.
+    
+    EventSource clients pass the token as ?jwt=. Each event's id is the
+    notification id, so reconnecting with Last-Event-ID (or ?last_event_id=)
+    resumes without gaps; otherwise only notifications created after
+    connecting are sent.
+    """
+    user_id = int(get_jwt_identity())
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_id is not None:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid last event id'}), 400
+    
+    # Each stream holds a server thread for its whole life: keep enough threads for everything else
+    if not bus.open_stream():
+        return jsonify({'error': 'Too many open streams, please retry'}), 503, {'Retry-After': '5'}
+    
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    batch_size = current_app.config['SSE_BATCH_SIZE']
+    
+    def generate():
+        nonlocal last_id
+        # Subscribe before reading so nothing committed from here on is missed
+        subscription = bus.subscribe(user_id)
+        try:
+            if last_id is None:
+                last_id = db.session.query(db.func.max(Notification.id)).filter(
+                    Notification.user_id == user_id
+                ).scalar() or 0
+            yield 'retry: 3000\n\n'
+            
+            while True:
+                notifications = Notification.query.filter(
+                    Notification.user_id == user_id,
+                    Notification.id > last_id
+                ).order_by(Notification.id).limit(batch_size).all()
+                events = [(n.id, n.to_dict()) for n in notifications]
+                # Don't hold a pooled connection while the stream is idle
+                db.session.close()
+                
+                for notification_id, payload in events:
+                    yield f'id: {notification_id}\nevent: notification\ndata: {json.dumps(payload)}\n\n'
+                    last_id = notification_id
+                
+                if len(events) == batch_size:
+                    continue
+                if not subscription.wait(heartbeat):
+                    yield ': heartbeat\n\n'
+        finally:
+            bus.unsubscribe(subscription)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Released on close, which also runs when the client leaves before the first event
+    response.call_on_close(bus.close_stream)
+    return response
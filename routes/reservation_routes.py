@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Book, Reservation, Notification
+from datetime import datetime
+from models import HOLD_DAYS, Book, Reservation, Notification
 from extensions import db, jwt
+from inventory import close_reservation, join_queue, leave_queue, promote_holds, restore_copy, take_copy
+from serializers import RESERVATION
 
 reservation_bp = Blueprint('reservation', __name__, url_prefix='/api/reservations')
 
@@ -19,36 +22,49 @@ def create_reservation():
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
-    if book.available_copies <= 0:
-        return jsonify({'error': 'Book not available'}), 400
-    
-    # Check if user already has active reservation
-    existing = Reservation.query.filter_by(
-        user_id=user_id,
-        book_id=book.id,
-        status='active'
+    # Check if user already has active or queued reservation
+    existing = Reservation.query.filter(
+        Reservation.user_id == user_id,
+        Reservation.book_id == book.id,
+        Reservation.status.in_(('active', 'queued'))
     ).first()
     
     if existing:
         return jsonify({'error': 'You already have an active reservation for this book'}), 409
     
-    reservation = Reservation(user_id=user_id, book_id=book.id)
-    book.available_copies -= 1
-    
+    # Hold a copy if one is free, otherwise wait in the book's queue
+    ticket = None
+    if not take_copy(book.id, reserve=True):
+        ticket = join_queue(book.id)
+        if ticket is None and not take_copy(book.id, reserve=True):
+            db.session.rollback()
+            return jsonify({'error': 'Book availability changed, please retry'}), 409
+    
+    if ticket is None:
+        reservation = Reservation(user_id=user_id, book_id=book.id)
+        message = f'You have reserved "{book.title}". Please pick it up within {HOLD_DAYS} days.'
+    else:
+        reservation = Reservation(
+            user_id=user_id,
+            book_id=book.id,
+            status='queued',
+            queued_at=datetime.utcnow(),
+            queue_ticket=ticket
+        )
+        message = f'No copy of "{book.title}" is free right now. You will be notified when one is held for you.'
     db.session.add(reservation)
-    db.session.commit()
     
     # Create notification
     notification = Notification(
         user_id=user_id,
-        message=f'You have reserved "{book.title}". Please pick it up within 3 days.',
+        message=message,
         type='reservation'
     )
     db.session.add(notification)
     db.session.commit()
     
     return jsonify({
-        'message': 'Book reserved successfully',
+        'message': 'Book reserved successfully' if ticket is None else 'Added to the waiting list',
         'reservation': reservation.to_dict()
     }), 201
 
@@ -58,10 +74,12 @@ def create_reservation():
 def get_reservations():
     user_id = int(get_jwt_identity())
     
-    reservations = Reservation.query.filter_by(user_id=user_id).order_by(Reservation.reserved_at.desc()).all()
+    rows = db.session.execute(
+        RESERVATION.select().where(Reservation.user_id == user_id).order_by(Reservation.reserved_at.desc())
+    )
     
     return jsonify({
-        'reservations': [r.to_dict() for r in reservations]
+        'reservations': RESERVATION.to_dicts(rows)
     }), 200
 
 
@@ -77,12 +95,16 @@ def cancel_reservation(reservation_id):
     if reservation.user_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    if reservation.status != 'active':
+    if reservation.status == 'queued':
+        if not leave_queue(reservation.id, reservation.book_id):
+            return jsonify({'error': 'Reservation cannot be cancelled'}), 400
+    elif close_reservation(reservation.id, 'cancelled'):
+        # The held copy goes to the next patron in the queue, if any
+        restore_copy(reservation.book_id, unreserve=True)
+        promote_holds(reservation.book_id)
+    else:
         return jsonify({'error': 'Reservation cannot be cancelled'}), 400
     
-    reservation.status = 'cancelled'
-    reservation.book.available_copies += 1
-    
     db.session.commit()
     
     return jsonify({'message': 'Reservation cancelled successfully'}), 200
@@ -0,0 +1,101 @@
+import re
+from extensions import db
+from models import Book
+
+# Full-text search over book titles and authors.
+#
+# PostgreSQL: a generated, weighted tsvector column with a GIN index, plus
+# pg_trgm indexes so substring ILIKE filters on title/author stay indexed.
+# SQLite: an external-content FTS5 table kept in sync by triggers on books.
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(author, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+]
+
+books_fts = db.table('books_fts', db.column('books_fts'), db.column('rowid'), db.column('rank'))
+
+
+def install_search_index(connection):
+    """Create the search column/table and indexes if they don't exist yet"""
+    statements = {
+        'postgresql': POSTGRES_DDL,
+        'sqlite': SQLITE_DDL
+    }.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.execute(db.text(statement))
+
+
+def rebuild_search_index(connection):
+    install_search_index(connection)
+    if connection.dialect.name == 'sqlite':
+        connection.execute(db.text("INSERT INTO books_fts(books_fts) VALUES ('rebuild')"))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(db.text("REINDEX INDEX ix_books_search_vector"))
+
+
+db.event.listen(
+    Book.__table__,
+    'after_create',
+    lambda target, connection, **kw: install_search_index(connection)
+)
+
+
+def search_tokens(term):
+    return re.findall(r'\w+', term.lower())
+
+
+def apply_search(query, term):
+    """Restrict `query` to books matching every word of `term` as a prefix.
+
+    Returns the filtered query and a rank expression that sorts the best
+    match first in ascending order.
+    """
+    tokens = search_tokens(term)
+    if not tokens:
+        return query.filter(db.false()), Book.id
+
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        tsquery = db.func.to_tsquery('simple', ' & '.join(f'{token}:*' for token in tokens))
+        search_vector = db.literal_column('books.search_vector')
+        query = query.filter(search_vector.op('@@')(tsquery))
+        return query, -db.func.ts_rank(search_vector, tsquery)
+
+    if dialect == 'sqlite':
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        query = query.join(books_fts, books_fts.c.rowid == Book.id).filter(
+            books_fts.c.books_fts.op('MATCH')(match)
+        )
+        return query, books_fts.c.rank
+
+    pattern_filters = [
+        db.or_(Book.title.ilike(f'%{token}%'), Book.author.ilike(f'%{token}%'))
+        for token in tokens
+    ]
+    return query.filter(*pattern_filters), Book.id
@@ -0,0 +1,120 @@
+from extensions import db
+from models import LOAN_DAYS, Book, Borrowing, Notification, Reservation, User
+
+# Column projections for list responses. They select exactly the fields a
+# response shows, joined columns included, as plain rows and turn them into
+# dicts without building ORM entities or lazy-loading relationships. The dicts
+# have the same keys as the models' to_dict(), but datetimes stay datetime
+# objects; the app's JSON provider writes them as ISO 8601.
+
+
+class Projection:
+    def __init__(self, base, joins=(), **fields):
+        self.base = base
+        self.joins = joins
+        self.keys = tuple(fields)
+        self.columns = tuple(column.label(key) for key, column in fields.items())
+
+    def select(self, *extra_columns):
+        """SELECT of the projected columns (and any `extra_columns` after them)"""
+        statement = db.select(*self.columns, *extra_columns).select_from(self.base)
+        for target, onclause in self.joins:
+            statement = statement.join(target, onclause)
+        return statement
+
+    def to_dict(self, row):
+        return dict(zip(self.keys, row))
+
+    def to_dicts(self, rows):
+        keys = self.keys
+        return [dict(zip(keys, row)) for row in rows]
+
+
+# Same rule as Book.get_status, evaluated by the database
+BOOK_STATUS = db.case(
+    (Book.available_copies > 0, 'available'),
+    (Book.active_reservations > 0, 'reserved'),
+    else_='borrowed'
+)
+
+# Same as Reservation.to_dict: place in the book's hold queue and the wait
+# estimate of estimated_wait_days(), NULL unless queued
+_cancelled = db.aliased(Reservation)
+_PLACE = Reservation.queue_ticket - Book.queue_served - db.select(db.func.count(_cancelled.id)).where(
+    _cancelled.book_id == Reservation.book_id,
+    _cancelled.status == 'cancelled',
+    _cancelled.queue_ticket > Book.queue_served,
+    _cancelled.queue_ticket < Reservation.queue_ticket
+).scalar_subquery()
+QUEUE_POSITION = db.case((Reservation.status == 'queued', _PLACE))
+_COPIES = db.case((Book.total_copies > 1, Book.total_copies), else_=1)
+ESTIMATED_WAIT_DAYS = db.case((
+    Reservation.status == 'queued',
+    (_PLACE + _COPIES - 1) // _COPIES * LOAN_DAYS
+))
+
+BOOK = Projection(
+    Book,
+    id=Book.id,
+    title=Book.title,
+    author=Book.author,
+    category=Book.category,
+    isbn=Book.isbn,
+    total_copies=Book.total_copies,
+    available_copies=Book.available_copies,
+    status=BOOK_STATUS,
+    queue_length=Book.queue_tickets - Book.queue_served - Book.queue_cancelled,
+    description=Book.description,
+    created_at=Book.created_at
+)
+
+BORROWING = Projection(
+    Borrowing,
+    [(Book, Borrowing.book_id == Book.id)],
+    id=Borrowing.id,
+    user_id=Borrowing.user_id,
+    book_id=Borrowing.book_id,
+    book_title=Book.title,
+    borrowed_at=Borrowing.borrowed_at,
+    due_date=Borrowing.due_date,
+    returned_at=Borrowing.returned_at,
+    is_overdue=Borrowing.is_overdue
+)
+
+RESERVATION = Projection(
+    Reservation,
+    [(Book, Reservation.book_id == Book.id)],
+    id=Reservation.id,
+    user_id=Reservation.user_id,
+    book_id=Reservation.book_id,
+    book_title=Book.title,
+    status=Reservation.status,
+    reserved_at=Reservation.reserved_at,
+    expires_at=Reservation.expires_at,
+    queue_position=QUEUE_POSITION,
+    estimated_wait_days=ESTIMATED_WAIT_DAYS
+)
+
+# Admin view of reservations with the reserving user
+RESERVATION_REPORT = Projection(
+    Reservation,
+    [(User, Reservation.user_id == User.id), (Book, Reservation.book_id == Book.id)],
+    reservation_id=Reservation.id,
+    user_id=User.id,
+    user_name=User.name,
+    user_email=User.email,
+    reservation_status=Reservation.status,
+    reserved_at=Reservation.reserved_at,
+    expires_at=Reservation.expires_at,
+    book_id=Book.id,
+    book_title=Book.title
+)
+
+NOTIFICATION = Projection(
+    Notification,
+    id=Notification.id,
+    message=Notification.message,
+    type=Notification.type,
+    is_read=Notification.is_read,
+    created_at=Notification.created_at
+)
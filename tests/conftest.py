@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# The app reads its configuration from the environment when it is imported
+os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/library.db'
+os.environ['CACHE_BACKEND'] = 'null'
+os.environ['PASSWORD_HASH_PROCESSES'] = '0'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['JWT_SECRET_KEY'] = 'test-secret-key-of-at-least-32-bytes'
+# Keep the periodic blocklist refresh out of statement counts
+os.environ['TOKEN_BLOCKLIST_REFRESH_SECONDS'] = '3600'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from extensions import db  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+    assert flask_app.test_client().post('/api/init-db').status_code == 200
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def _login(client, email, password):
+    response = client.post('/api/auth/login', json={'email': email, 'password': password})
+    return {'Authorization': f'Bearer {response.get_json()["access_token"]}'}
+
+
+@pytest.fixture
+def admin_headers(client):
+    return _login(client, 'admin@library.com', 'admin123')
+
+
+@pytest.fixture
+def member_headers(client):
+    return _login(client, 'user@library.com', 'user123')
+
+
+@pytest.fixture
+def member(app):
+    return User.query.filter_by(email='user@library.com').one()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting every SQL statement run inside it"""
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return counting
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models import Book, Borrowing, Reservation
+
+
+def add_sold_out_books(count, member):
+    """`count` books with no copy on the shelf, each with a reservation history"""
+    books = [
+        Book(title=f'Sold out {n}', author='Author', category='Fiction',
+             total_copies=1, available_copies=0, active_reservations=n % 2)
+        for n in range(count)
+    ]
+    db.session.add_all(books)
+    db.session.flush()
+    for book in books:
+        db.session.add_all([
+            Reservation(user_id=member.id, book_id=book.id, status='fulfilled'),
+            Reservation(user_id=member.id, book_id=book.id, status='active' if book.active_reservations else 'expired'),
+        ])
+    db.session.commit()
+
+
+def add_borrowings(count, member):
+    books = [Book(title=f'Borrowed {n}', author='Author', category='Fiction') for n in range(count)]
+    db.session.add_all(books)
+    db.session.flush()
+    db.session.add_all(
+        Borrowing(user_id=member.id, book_id=book.id, due_date=datetime.utcnow() + timedelta(days=14))
+        for book in books
+    )
+    db.session.commit()
+
+
+def queries_for(count_queries, request):
+    request()  # the first request also loads per-worker state such as the token blocklist
+    with count_queries() as statements:
+        response = request()
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+@pytest.mark.parametrize('endpoint', ['/api/books', '/api/books?limit=100'])
+def test_listing_query_count_does_not_grow_with_sold_out_books(client, member, count_queries, endpoint):
+    add_sold_out_books(3, member)
+    few, _ = queries_for(count_queries, lambda: client.get(endpoint))
+
+    add_sold_out_books(40, member)
+    many, body = queries_for(count_queries, lambda: client.get(endpoint))
+
+    assert many == few
+    statuses = {book['title']: book['status'] for book in body['books']}
+    assert statuses['Sold out 1'] == 'reserved'
+    assert statuses['Sold out 2'] == 'borrowed'
+
+
+def test_book_to_dict_reads_status_from_the_row(app, member, count_queries):
+    add_sold_out_books(20, member)
+    books = Book.query.all()
+
+    with count_queries() as statements:
+        statuses = [book.to_dict()['status'] for book in books]
+
+    assert statements == []
+    assert statuses.count('reserved') == 10
+
+
+def test_profile_query_count_does_not_grow_with_borrowings(client, member, member_headers, count_queries):
+    add_borrowings(3, member)
+    few, _ = queries_for(count_queries, lambda: client.get('/api/auth/profile', headers=member_headers))
+
+    add_borrowings(40, member)
+    many, body = queries_for(count_queries, lambda: client.get('/api/auth/profile', headers=member_headers))
+
+    assert many == few
+    assert body['borrowing_history'][0]['book_title'].startswith('Borrowed')
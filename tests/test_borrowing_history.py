@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import Book, Borrowing
+
+
+def add_history(count, member, returned=0):
+    """`count` loans for `member`, the first `returned` of them already returned"""
+    started = datetime.utcnow() - timedelta(days=count)
+    books = [Book(title=f'History {n}', author='Author', category='Fiction') for n in range(count)]
+    db.session.add_all(books)
+    db.session.flush()
+    db.session.add_all(
+        Borrowing(
+            user_id=member.id, book_id=book.id,
+            borrowed_at=started + timedelta(days=n),
+            due_date=started + timedelta(days=n + 14),
+            returned_at=started + timedelta(days=n + 1) if n < returned else None
+        )
+        for n, book in enumerate(books)
+    )
+    db.session.commit()
+
+
+def count_request(client, count_queries, url, headers):
+    client.get(url, headers=headers)  # the first request also loads per-worker state such as the token blocklist
+    with count_queries() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(statements), response.get_json()
+
+
+def test_user_history_query_count_does_not_grow_with_history(client, member, admin_headers, count_queries):
+    url = f'/api/admin/reports/user-history/{member.id}'
+    add_history(2, member)
+    few, _ = count_request(client, count_queries, url, admin_headers)
+
+    add_history(120, member, returned=100)
+    many, body = count_request(client, count_queries, url, admin_headers)
+
+    assert many == few
+    assert body['total_borrowed'] == 122
+    assert body['currently_borrowed'] == 22
+    assert all(loan['book_title'] for loan in body['borrowing_history'])
+
+
+def test_history_pages_cost_the_same_as_the_first(client, member, member_headers, count_queries):
+    add_history(75, member)
+    first, body = count_request(client, count_queries, '/api/auth/profile?limit=20', member_headers)
+    seen = [loan['id'] for loan in body['borrowing_history']]
+
+    while body['next_cursor']:
+        url = f'/api/auth/profile?limit=20&after={body["next_cursor"]}'
+        queries, body = count_request(client, count_queries, url, member_headers)
+        assert queries == first
+        seen += [loan['id'] for loan in body['borrowing_history']]
+
+    assert len(seen) == len(set(seen)) == 75
@@ -0,0 +1,29 @@
+from extensions import db
+from facets import catalog_facets, filtered_facets
+from jobs import compact_facet_deltas
+from models import Book
+
+
+def assert_counts_match_books():
+    assert catalog_facets(100) == filtered_facets(db.select(Book.id), 100)
+
+
+def test_catalog_facets_follow_every_kind_of_write(client, member, admin_headers):
+    assert_counts_match_books()
+
+    for _ in range(2):  # both copies of 'To Kill a Mockingbird'
+        response = client.post('/api/borrowings', json={'user_id': member.id, 'book_id': 2}, headers=admin_headers)
+        assert response.status_code == 201
+    client.put('/api/books/1', json={'category': 'Classics', 'available_copies': 0}, headers=admin_headers)
+    client.delete('/api/books/4', headers=admin_headers)
+    client.post(
+        '/api/books/import?format=csv', headers=admin_headers,
+        data=b'title,author,category,isbn,total_copies\nNew,Someone,Poetry,111,0\nOther,Someone,Poetry,,2\n'
+    )
+    assert_counts_match_books()
+    facets = catalog_facets()
+    assert facets['availability'] == {'available': 3, 'borrowed': 3, 'reserved': 0}
+    assert {'value': 'Classics', 'count': 1} in facets['categories']
+
+    compact_facet_deltas()
+    assert catalog_facets() == facets
@@ -0,0 +1,29 @@
+import time
+
+from token_blocklist import TokenBlocklist
+
+
+def blocklist_revoking(user_id, revoked):
+    blocklist = TokenBlocklist()
+    blocklist._next_refresh = float('inf')  # no database
+    blocklist.add_cutoff(user_id, revoked, time.time() + 3600)
+    return blocklist
+
+
+def token(user_id, issued):
+    return {'jti': f'token-{issued}', 'sub': str(user_id), 'iat': issued}
+
+
+def test_revoking_a_user_revokes_tokens_from_earlier_seconds():
+    blocklist = blocklist_revoking(7, 1_700_000_000.4)
+
+    assert blocklist.is_revoked(token(7, 1_699_999_999))
+    assert not blocklist.is_revoked(token(8, 1_699_999_999))
+
+
+def test_login_right_after_revoking_gets_a_working_token():
+    # iat is whole seconds, so a login later in the revocation's second carries the floored time
+    blocklist = blocklist_revoking(7, 1_700_000_000.4)
+
+    assert not blocklist.is_revoked(token(7, 1_700_000_000))
+    assert not blocklist.is_revoked(token(7, 1_700_000_001))
@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from extensions import db, jwt
+from models import TokenRevocation
+
+# Revoked tokens are recorded in token_revocations (the source of truth) and
+# mirrored in memory by every worker, so the per-request check is a set and a
+# dict lookup. Each worker re-reads the rows revoked since its last look at
+# most once per TOKEN_BLOCKLIST_REFRESH_SECONDS; revocations made by this
+# worker apply immediately, those made by others within that interval.
+
+REFRESH_OVERLAP = timedelta(seconds=60)  # re-read recent rows in case they committed late
+PURGE_INTERVAL = 60
+
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenBlocklist:
+    def __init__(self):
+        self._jtis = {}  # jti -> expiry (epoch seconds)
+        self._cutoffs = {}  # user id (JWT sub) -> (newest revoked iat, expiry)
+        self._lock = threading.Lock()
+        self._since = None
+        self._next_refresh = 0.0
+        self._next_purge = 0.0
+
+    def is_revoked(self, payload):
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        if payload['jti'] in self._jtis:
+            return True
+        cutoff = self._cutoffs.get(payload['sub'])
+        # iat has one-second resolution, so only tokens issued in an earlier second are
+        # revoked: a login right after the revocation must work, at the price of a token
+        # issued earlier in the revocation's own second staying valid
+        return cutoff is not None and payload['iat'] < cutoff[0]
+
+    def add_token(self, jti, expires):
+        self._jtis[jti] = expires
+
+    def add_cutoff(self, user_id, revoked, expires):
+        key = str(user_id)
+        current = self._cutoffs.get(key)
+        if current is None or current[0] < revoked:
+            self._cutoffs[key] = (math.floor(revoked), expires)
+
+    def refresh(self):
+        """Load revocations recorded since the last refresh (all live ones the first time)"""
+        if not self._lock.acquire(blocking=False):
+            return  # another thread is already refreshing
+        try:
+            if time.monotonic() < self._next_refresh:
+                return
+            now = datetime.utcnow()
+            query = db.select(
+                TokenRevocation.jti, TokenRevocation.user_id,
+                TokenRevocation.revoked_at, TokenRevocation.expires_at
+            ).where(TokenRevocation.expires_at > now)
+            if self._since is not None:
+                query = query.where(TokenRevocation.revoked_at > self._since - REFRESH_OVERLAP)
+            try:
+                with db.engine.connect() as connection:
+                    rows = connection.execute(query).all()
+            except Exception:
+                current_app.logger.exception('Could not refresh the token blocklist')
+                rows = None
+            if rows is not None:
+                for jti, user_id, revoked_at, expires_at in rows:
+                    if jti:
+                        self.add_token(jti, _epoch(expires_at))
+                    else:
+                        self.add_cutoff(user_id, _epoch(revoked_at), _epoch(expires_at))
+                self._since = now
+            if time.monotonic() >= self._next_purge:
+                self._purge()
+            self._next_refresh = time.monotonic() + current_app.config['TOKEN_BLOCKLIST_REFRESH_SECONDS']
+        finally:
+            self._lock.release()
+
+    def _purge(self):
+        # Swap in pruned copies so concurrent lookups never see a dict being resized
+        now = time.time()
+        self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > now}
+        self._cutoffs = {key: cutoff for key, cutoff in self._cutoffs.items() if cutoff[1] > now}
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+
+
+blocklist = TokenBlocklist()
+
+
+@jwt.token_in_blocklist_loader
+def _is_token_revoked(jwt_header, jwt_payload):
+    return blocklist.is_revoked(jwt_payload)
+
+
+def revoke_token(payload):
+    """Revoke the access token with these claims and commit"""
+    expires_at = datetime.utcfromtimestamp(payload['exp'])
+    db.session.add(TokenRevocation(jti=payload['jti'], user_id=int(payload['sub']), expires_at=expires_at))
+    _delete_expired()
+    db.session.commit()
+    blocklist.add_token(payload['jti'], _epoch(expires_at))
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every access token issued to `user_id` so far and commit"""
+    revoked_at = datetime.utcnow()
+    expires_at = revoked_at + current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    db.session.add(TokenRevocation(user_id=user_id, revoked_at=revoked_at, expires_at=expires_at))
+    _delete_expired()
+    db.session.commit()
+    blocklist.add_cutoff(user_id, _epoch(revoked_at), _epoch(expires_at))
+
+
+def _delete_expired():
+    db.session.execute(db.delete(TokenRevocation).where(TokenRevocation.expires_at <= datetime.utcnow()))
@@ -0,0 +1,329 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Book
+from catalog_cache import catalog_reloaded
+
+# Prefix index over book titles, authors and ISBNs for the search box. Every
+# worker builds it from the books table in the background on first use (until
+# then suggest() returns None and callers fall back to the database) and then
+# applies the books it commits itself; catalog reloads (imports, generated data) and
+# changes committed by other workers are picked up by a full rebuild once the
+# index is TYPEAHEAD_MAX_AGE_SECONDS old, done in the background while the old
+# index keeps answering.
+#
+# Layout, kept small enough for millions of books: every book has a slot in
+# a list of "title\x1fauthor\x1fisbn\x1f words" strings: display fields, then
+# folded words, so a further query word is checked with one substring test.
+# A sorted list of distinct title and author words, where a prefix is a bisect
+# range, maps each word to an array of slots; ISBNs, unique per book, are a
+# sorted list of keys without separators and a parallel slot array instead.
+# Sorted book id and slot arrays find a book's slot.
+
+SEPARATOR = '\x1f'
+MAX_SCANNED = 1000  # candidates checked per query, bounds the cost of words that rarely occur together
+BUILD_BATCH_SIZE = 10000
+INDEXED_FIELDS = ('title', 'author', 'isbn')
+
+
+def fold(text):
+    """Lowercase `text` and strip accents, so 'Émile' matches 'emile'"""
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', fold(text))
+
+
+def isbn_key(isbn):
+    """ISBN without hyphens or spaces, as people type it"""
+    return re.sub(r'[\W_]', '', isbn).lower() if isbn else ''
+
+
+class TypeaheadIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = []  # slot -> packed book, None once freed
+        self._slot_ids = array('I')  # slot -> book id
+        self._free = []  # freed slots
+        self._ids = array('I')  # sorted book ids ...
+        self._id_slots = array('I')  # ... and their slots
+        self._words = []  # sorted distinct title/author words
+        self._postings = {}  # word -> array of slots
+        self._isbns = []  # sorted ISBN keys ...
+        self._isbn_slots = array('I')  # ... and their slots
+        self._built_at = None  # monotonic time of the last full build, None until built
+        self._stale = False
+        self._building = False
+        self._pending = None  # changes committed while a rebuild reads the table
+
+    # Queries
+
+    def suggest(self, term, limit=10):
+        """Books whose title, author or ISBN words start with every word of
+        `term`, or None while the index is first being built"""
+        self._ensure_fresh()
+        if self._built_at is None:
+            return None
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+        with self._lock:
+            if len(tokens) > 1:
+                # '978-0-14' or '978 0': the whole term may be a typed ISBN
+                start, stop = _prefix_range(self._isbns, isbn_key(term))
+                if start < stop:
+                    return [
+                        _suggestion(self._slot_ids[slot], self._docs[slot])
+                        for slot in self._isbn_slots[start:min(stop, start + limit)]
+                    ]
+
+            # Walk the prefix matching the fewest books, check the others per candidate
+            driver, others = tokens[0], []
+            if len(tokens) > 1:
+                counts = sorted((self._count(token), i) for i, token in enumerate(tokens))
+                driver = tokens[counts[0][1]]
+                others = [' ' + tokens[i] for _, i in counts[1:]]
+
+            docs, results, seen = self._docs, [], set()
+            for slot in self._candidates(driver):
+                if slot in seen:
+                    continue
+                seen.add(slot)
+                doc = docs[slot]
+                for word in others:
+                    if word not in doc:
+                        break
+                else:
+                    results.append(_suggestion(self._slot_ids[slot], doc))
+                    if len(results) >= limit:
+                        break
+                if len(seen) >= MAX_SCANNED:
+                    break
+            return results
+
+    def _count(self, prefix):
+        """Books matching `prefix`, counted up to a few times MAX_SCANNED"""
+        start, stop = _prefix_range(self._isbns, prefix)
+        count = stop - start
+        start, stop = _prefix_range(self._words, prefix)
+        for position in range(start, stop):
+            count += len(self._postings[self._words[position]])
+            if count >= MAX_SCANNED * 4:
+                break
+        return count
+
+    def _candidates(self, prefix):
+        start, stop = _prefix_range(self._isbns, prefix)
+        yield from self._isbn_slots[start:stop]
+        start, stop = _prefix_range(self._words, prefix)
+        for position in range(start, stop):
+            yield from self._postings[self._words[position]]
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'books': len(self._ids),
+                'words': len(self._words),
+                'age_seconds': round(time.monotonic() - self._built_at, 1) if self._built_at else None
+            }
+
+    # Maintenance
+
+    def add(self, book_id, title, author, isbn):
+        """Index a book, replacing what was indexed for it before"""
+        with self._lock:
+            self.remove(book_id)
+            words = set(tokenize(f'{title or ""} {author or ""}'))
+            if self._free:
+                slot = self._free.pop()
+                self._docs[slot] = _pack(title, author, isbn, words)
+                self._slot_ids[slot] = book_id
+            else:
+                slot = len(self._docs)
+                self._docs.append(_pack(title, author, isbn, words))
+                self._slot_ids.append(book_id)
+            position = bisect.bisect_left(self._ids, book_id)
+            self._ids.insert(position, book_id)
+            self._id_slots.insert(position, slot)
+            for word in words:
+                slots = self._postings.get(word)
+                if slots is None:
+                    self._postings[word] = slots = array('I')
+                    bisect.insort(self._words, word)
+                slots.append(slot)
+            key = isbn_key(isbn)
+            if key:
+                position = bisect.bisect_right(self._isbns, key)
+                self._isbns.insert(position, key)
+                self._isbn_slots.insert(position, slot)
+
+    def remove(self, book_id):
+        with self._lock:
+            position = bisect.bisect_left(self._ids, book_id)
+            if position == len(self._ids) or self._ids[position] != book_id:
+                return
+            slot = self._id_slots[position]
+            del self._ids[position]
+            del self._id_slots[position]
+            title, author, isbn, _ = self._docs[slot].split(SEPARATOR)
+            self._docs[slot] = None
+            self._free.append(slot)
+            for word in set(tokenize(f'{title} {author}')):
+                slots = self._postings[word]
+                slots.remove(slot)
+                if not slots:
+                    del self._postings[word]
+                    del self._words[bisect.bisect_left(self._words, word)]
+            key = isbn_key(isbn)
+            if key:
+                position = bisect.bisect_left(self._isbns, key)
+                while self._isbn_slots[position] != slot:
+                    position += 1
+                del self._isbns[position]
+                del self._isbn_slots[position]
+
+    def apply(self, changes):
+        """Apply committed changes, {book id: (title, author, isbn) or None if deleted}"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(changes)
+            if self._built_at is None:
+                return
+            for book_id, fields in changes.items():
+                if fields is None:
+                    self.remove(book_id)
+                else:
+                    self.add(book_id, *fields)
+
+    def invalidate(self):
+        """Rebuild on next use (after bulk changes the session didn't track)"""
+        self._stale = True
+
+    def _ensure_fresh(self):
+        max_age = current_app.config['TYPEAHEAD_MAX_AGE_SECONDS']
+        if self._built_at is None or self._stale or (max_age and time.monotonic() - self._built_at >= max_age):
+            with self._lock:
+                if self._building:
+                    return
+                self._building = True
+            app = current_app._get_current_object()
+            threading.Thread(target=self._rebuild_in_background, args=(app,), daemon=True).start()
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.build()
+        except Exception:
+            app.logger.exception('Could not rebuild the typeahead index')
+        finally:
+            self._building = False
+
+    def build(self):
+        """Read every book into a fresh index and swap it in"""
+        with self._lock:
+            self._pending = {}
+        self._stale = False
+        try:
+            with db.engine.connect() as connection:
+                rows = connection.execution_options(yield_per=BUILD_BATCH_SIZE).execute(
+                    db.select(Book.id, Book.title, Book.author, Book.isbn).order_by(Book.id)
+                )
+                fresh = TypeaheadIndex.from_rows(rows)
+            with self._lock:
+                fresh.apply(self._pending)  # committed while the table was being read
+                for name in ('_docs', '_slot_ids', '_free', '_ids', '_id_slots',
+                             '_words', '_postings', '_isbns', '_isbn_slots', '_built_at'):
+                    setattr(self, name, getattr(fresh, name))
+        finally:
+            with self._lock:
+                self._pending = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Index of (id, title, author, isbn) rows given in id order"""
+        built = cls()
+        built._built_at = time.monotonic()
+        postings, isbns = built._postings, []
+        for slot, (book_id, title, author, isbn) in enumerate(rows):
+            words = set(tokenize(f'{title or ""} {author or ""}'))
+            built._docs.append(_pack(title, author, isbn, words))
+            built._slot_ids.append(book_id)
+            for word in words:
+                slots = postings.get(word)
+                if slots is None:
+                    postings[word] = slots = array('I')
+                slots.append(slot)
+            key = isbn_key(isbn)
+            if key:
+                isbns.append((key, slot))
+        built._ids = array('I', built._slot_ids)
+        built._id_slots = array('I', range(len(built._docs)))
+        built._words = sorted(postings)
+        isbns.sort()
+        built._isbns = [key for key, _ in isbns]
+        built._isbn_slots = array('I', (slot for _, slot in isbns))
+        return built
+
+
+def _pack(title, author, isbn, words):
+    key = isbn_key(isbn)
+    searchable = ' '.join(sorted(words | {key} if key else words))
+    return SEPARATOR.join((title or '', author or '', isbn or '', ' ' + searchable))
+
+
+def _suggestion(book_id, doc):
+    title, author, isbn, _ = doc.split(SEPARATOR)
+    return {'id': book_id, 'title': title, 'author': author, 'isbn': isbn or None}
+
+
+def _prefix_range(keys, prefix):
+    start = bisect.bisect_left(keys, prefix)
+    return start, bisect.bisect_left(keys, prefix + '\U0010ffff', start)
+
+
+index = TypeaheadIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_book_changes(session, flush_context):
+    changes = session.info.setdefault('typeahead_changes', {})
+    for book in session.new:
+        if isinstance(book, Book):
+            changes[book.id] = (book.title, book.author, book.isbn)
+    for book in session.deleted:
+        if isinstance(book, Book):
+            changes[book.id] = None
+    for book in session.dirty:
+        if isinstance(book, Book):
+            state = inspect(book)
+            if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+                changes[book.id] = (book.title, book.author, book.isbn)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('typeahead_changes', None)
+    if changes:
+        index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('typeahead_changes', None)
+
+
+@catalog_reloaded.connect
+def _rebuild_after_reload(sender):
+    index.invalidate()